@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the replay, simulation and plotting data preparation code on
+synthetic leagues.
+
+Results are written as JSON so that runs from different commits can be
+compared:
+
+    ./bench.py --teams 50 --seasons 20 --out before.json
+    git checkout other-branch
+    ./bench.py --teams 50 --seasons 20 --out after.json
+"""
+
+import argparse
+import json
+import os.path as path
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import predict
+import vello
+import elo
+
+
+def synthetic_league(teams=8, seasons=10, matches_per_season=60, seed=0):
+    """
+    Generate a league's match history in the format of `data/games.csv`.
+
+    Every team has a fixed true strength. Each season runs from September to
+    November, followed by a four-team postseason.
+
+    :returns: Match dataframe with a string `date` column, as read from CSV.
+
+    """
+    rng = np.random.default_rng(seed)
+    names = ["Team {}".format(k) for k in range(teams)]
+    strength = rng.normal(1500, 150, size=teams)
+
+    rows = []
+    for season in range(seasons):
+        start = np.datetime64("{}-09-01".format(2000 + season))
+        days = np.sort(rng.integers(0, 75, size=matches_per_season))
+
+        games = [(rng.choice(teams, size=2, replace=False), False, start + day)
+                 for day in days]
+
+        top = np.argsort(-strength)[:4]
+        final = start + 80
+        games += [(top[[0, 3]], True, final), (top[[1, 2]], True, final),
+                  (top[[0, 1]], True, final + 1)]
+
+        for (home, away), postseason, date in games:
+            p = 1 / (1 + 10**(-(strength[home] - strength[away]) / 400))
+            loser_sets = rng.integers(0, 3)
+            if rng.random() < p:
+                score = (3, loser_sets)
+            else:
+                score = (loser_sets, 3)
+
+            rows.append((names[home], names[away], score[0], score[1],
+                         postseason, str(date)))
+
+    return pd.DataFrame(rows, columns=["home", "away", "home_score",
+                                       "away_score", "postseason", "date"])
+
+
+def measure(func, repeat=3):
+    """
+    Time `func` and measure its peak traced memory.
+
+    :returns: Dictionary with the best wall-clock "seconds" over `repeat` runs
+              and the "peak_bytes" of a separate traced run.
+
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    # Tracing slows everything down, so measure memory separately.
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": min(times), "peak_bytes": peak}
+
+
+def run(teams=8, seasons=10, matches_per_season=60, iterations=(100, 1000, 10000),
+        repeat=3, seed=0):
+    """
+    Run every benchmark.
+
+    :returns: List of result dictionaries, one per benchmark.
+
+    """
+    league = synthetic_league(teams, seasons, matches_per_season, seed)
+    n_matches = len(league)
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = path.join(tmp, "games.csv")
+        league.to_csv(csv, index=False)
+
+        res = measure(lambda: vello.load_games(csv), repeat)
+        res.update(name="load_games", matches_per_second=n_matches / res["seconds"])
+        results.append(res)
+
+        league_teams, df = vello.load_games(csv)
+
+    def record():
+        fresh = [elo.Team(team.name, 1500) for team in league_teams]
+        return vello.record_games(df, fresh)
+
+    res = measure(record, repeat)
+    res.update(name="record_games", matches_per_second=n_matches / res["seconds"])
+    results.append(res)
+
+    elo_df = vello.record_games(df, league_teams)
+    season_df = elo_df[vello.season_years(elo_df) == vello.season_years(elo_df).max()]
+
+    res = measure(lambda: vello.team_elo_df(season_df), repeat)
+    res.update(name="team_elo_df", matches_per_second=len(season_df) / res["seconds"])
+    results.append(res)
+
+    schedule = season_df.reset_index(drop=True)
+
+    for n in iterations:
+        res = measure(lambda: predict.predict_season(schedule, league_teams, n, seed=seed),
+                      repeat)
+        res.update(name="predict_season", iterations=n,
+                   seasons_per_second=n / res["seconds"],
+                   matches_per_second=n * len(schedule) / res["seconds"])
+        results.append(res)
+
+    return results
+
+
+def environment():
+    """Describe the code and interpreter being benchmarked."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, cwd=path.dirname(path.abspath(__file__)))
+        commit = commit.stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {"commit": commit, "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__,
+            "machine": platform.machine()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Elo replays and simulations.")
+    parser.add_argument("--teams", type=int, default=8)
+    parser.add_argument("--seasons", type=int, default=10)
+    parser.add_argument("--matches", type=int, default=60,
+                        help="Regular season matches per season.")
+    parser.add_argument("--iterations", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Iteration counts for predict_season.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the results to this JSON file.")
+
+    args = parser.parse_args()
+
+    results = run(args.teams, args.seasons, args.matches, args.iterations,
+                  args.repeat, args.seed)
+
+    for res in results:
+        rate = res.get("seasons_per_second", res["matches_per_second"])
+        unit = "seasons/s" if "seasons_per_second" in res else "matches/s"
+        label = res["name"] + (" x{}".format(res["iterations"]) if "iterations" in res else "")
+        print("{:<26} {:>10.4f} s {:>14,.0f} {:<10} {:>8.1f} MiB".format(
+            label, res["seconds"], rate, unit, res["peak_bytes"] / 2**20))
+
+    if args.out:
+        config = {"teams": args.teams, "seasons": args.seasons,
+                  "matches_per_season": args.matches, "seed": args.seed}
+        with open(args.out, "w") as f:
+            json.dump({"environment": environment(), "config": config,
+                       "results": results}, f, indent=2)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""
+Declarative postseason brackets, simulated for many seasons at once.
+
+A bracket is a list of rounds, and each round is a list of games. Each side
+of a game is either a seed (an integer, 1 being the best) or the winner of an
+earlier game ("W0" is the winner of the first game, counting across rounds).
+A seed that first appears after the first round has a bye.
+
+The 2020 SAA format (the top four seeds, 1 v 4 and 2 v 3, then a final) is:
+
+    Bracket([[(1, 4), (2, 3)], [("W0", "W1")]])
+"""
+
+import numpy as np
+
+
+class Bracket:
+    def __init__(self, rounds, reseed=False, home_seed=False, home_advantage=0,
+                 tiebreakers=()):
+        """
+        :rounds: List of rounds of games, as described above.
+        :reseed: If True, every round after the first is re-paired so that the
+                 best remaining seed plays the worst, and so on. Only the
+                 number of games in those rounds matters.
+        :home_seed: If True, the better seed is the home team. Otherwise the
+                    first side of each game is.
+        :home_advantage: Elo bonus for the home team when drawing winners.
+        :tiebreakers: Names of statistics ("elo", "wins", "pct") that break
+                      ties in the win-loss differential, in order, higher
+                      being better. Remaining ties keep the team order.
+
+        """
+        self.rounds = [list(games) for games in rounds]
+        self.reseed = reseed
+        self.home_seed = home_seed
+        self.home_advantage = home_advantage
+        self.tiebreakers = tuple(tiebreakers)
+
+        seeds = set()
+        played = 0
+        for games in self.rounds:
+            for game in games:
+                for side in game:
+                    if isinstance(side, str):
+                        if not (side.startswith("W") and int(side[1:]) < played):
+                            raise ValueError("{} does not refer to an earlier game.".format(side))
+                    else:
+                        seeds.add(side)
+            played += len(games)
+
+        if seeds != set(range(1, len(seeds) + 1)):
+            raise ValueError("Bracket seeds must be 1 through {}.".format(len(seeds)))
+
+        self.size = len(seeds)
+        self.n_games = played
+
+    @classmethod
+    def single_elimination(cls, size, **kwargs):
+        """
+        Build a standard single elimination bracket for `size` seeds.
+
+        If `size` is not a power of two, the top seeds get first-round byes.
+        """
+        order = [1]
+        while len(order) < size:
+            n = 2 * len(order)
+            order = [s for seed in order for s in (seed, n + 1 - seed)]
+
+        rounds = []
+        sides = order
+        played = 0
+        while len(sides) > 1:
+            games = []
+            winners = []
+            for a, b in zip(sides[::2], sides[1::2]):
+                if isinstance(b, int) and b > size:
+                    winners.append(a)
+                elif isinstance(a, int) and a > size:
+                    winners.append(b)
+                else:
+                    games.append((a, b))
+                    winners.append("W{}".format(played + len(games) - 1))
+            rounds.append(games)
+            played += len(games)
+            sides = winners
+
+        return cls(rounds, **kwargs)
+
+    def rank(self, wins, losses, stats=None):
+        """
+        Rank the teams of every simulated season.
+
+        :wins: (iterations, teams) array of wins.
+        :losses: (iterations, teams) array of losses.
+        :stats: Dictionary of (iterations, teams) arrays for `tiebreakers`.
+        :returns: (iterations, teams) array of team columns, best first.
+
+        """
+        n_teams = wins.shape[1]
+        order = np.broadcast_to(np.arange(n_teams), wins.shape)
+
+        # `np.lexsort` sorts by the last key first.
+        keys = [order]
+        keys += [-stats[name] for name in reversed(self.tiebreakers)]
+        keys.append(-(wins - losses))
+
+        return np.lexsort(keys, axis=-1)
+
+    def simulate(self, rankings, draws, play):
+        """
+        Play the bracket in every simulated season at once.
+
+        :rankings: Output of `rank`.
+        :draws: (iterations, n_games) array of uniform draws, one column per
+                game in bracket order.
+        :play: Function `play(home, away, draws, home_advantage)` that plays a
+               game for every season (with arrays of team columns) and returns
+               a boolean array, True where the home team won.
+        :returns: (iterations, teams) array of how far each team got: 0 if it
+                  missed the bracket, r if it reached round r (counting from
+                  1), and one more than the number of rounds for the
+                  champion.
+
+        """
+        iterations, n_teams = rankings.shape
+        if self.size > n_teams:
+            raise ValueError("Bracket needs {} teams, but only {} were simulated."
+                             .format(self.size, n_teams))
+
+        rows = np.arange(iterations)
+        seed = np.empty_like(rankings)
+        seed[rows[:, None], rankings] = np.arange(n_teams)
+
+        reached = np.zeros((iterations, n_teams), dtype=np.int64)
+        winners = []
+
+        def team(side):
+            if isinstance(side, str):
+                return winners[int(side[1:])]
+            return rankings[:, side - 1]
+
+        for r, games in enumerate(self.rounds):
+            pairs = [(team(a), team(b)) for a, b in games]
+
+            if self.reseed and r > 0:
+                sides = np.stack([side for pair in pairs for side in pair], axis=1)
+                sides = np.take_along_axis(sides, np.argsort(seed[rows[:, None], sides],
+                                                             axis=1), axis=1)
+                pairs = [(sides[:, k], sides[:, -1 - k]) for k in range(len(games))]
+
+            for a, b in pairs:
+                reached[rows, a] = np.maximum(reached[rows, a], r + 1)
+                reached[rows, b] = np.maximum(reached[rows, b], r + 1)
+
+                if self.home_seed:
+                    a, b = (np.where(seed[rows, a] <= seed[rows, b], a, b),
+                            np.where(seed[rows, a] <= seed[rows, b], b, a))
+
+                won = play(a, b, draws[:, len(winners)], self.home_advantage)
+                winner = np.where(won, a, b)
+                reached[rows, winner] = r + 2
+                winners.append(winner)
+
+        return reached
+
+
+# The 2020 SAA playoff rules: top 4 seeds play each other in a tournament.
+TOP_FOUR = Bracket([[(1, 4), (2, 3)], [("W0", "W1")]])
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+Memoize Elo replays.
+
+A `ReplayCache` maps a content hash of the match data, the starting ratings
+and the replay parameters to the arrays produced by the replay. It has an
+in-memory LRU tier and an optional on-disk tier of `.npz` files; both are
+bounded and evict the least recently used entries first.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import os.path as path
+import numpy as np
+import pandas as pd
+from store import MATCH_COLUMNS
+
+
+class ReplayCache:
+    def __init__(self, maxsize=32, directory=None, max_bytes=256 * 2**20):
+        """
+        :maxsize: Maximum number of replays kept in memory.
+        :directory: Directory for the on-disk tier, or None to only use memory.
+        :max_bytes: Maximum total size of the on-disk tier.
+
+        """
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(match_df, names, elos, params):
+        """
+        Return the cache key of a replay.
+
+        :match_df: Match dataframe to replay.
+        :names: Team names, in the order of `elos`.
+        :elos: Starting rating of each team.
+        :params: Dictionary of replay parameters.
+
+        """
+        digest = hashlib.sha256()
+        # The postseason column is optional, like it is for the replay.
+        columns = [column for column in MATCH_COLUMNS if column in match_df]
+        hashes = pd.util.hash_pandas_object(match_df[columns], index=False)
+        digest.update(hashes.to_numpy().tobytes())
+        digest.update(json.dumps(list(names)).encode())
+        digest.update(np.asarray(elos, dtype=float).tobytes())
+
+        # JSON turns set_map keys into strings, which is fine for hashing.
+        digest.update(json.dumps(params, sort_keys=True).encode())
+
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """Return the cached replay for `key`, or None."""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+
+        if self.directory is not None and path.exists(self._path(key)):
+            with np.load(self._path(key)) as data:
+                result = dict(data)
+
+            # Mark the file as recently used for eviction.
+            os.utime(self._path(key))
+            self._remember(key, result)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """Store a replay result (a dictionary of arrays) under `key`."""
+        self._remember(key, result)
+
+        if self.directory is not None:
+            # Write to a temporary file first so readers never see half a file.
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, **result)
+            os.replace(tmp, self._path(key))
+            self._evict_disk()
+
+    def _remember(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                stat = os.stat(path.join(self.directory, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        """Empty both tiers."""
+        self.memory.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    os.remove(path.join(self.directory, name))
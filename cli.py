@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+Command-line entry point for volleyball Elo.
+
+    ./cli.py rate [csv]                   Current ratings after replaying history.
+    ./cli.py forecast [train] [test]      Simulate the rest of a season.
+    ./cli.py tune [train] [test] -K ...   Search Elo hyperparameters.
+    ./cli.py plot start stop              Plot historical Elo (needs matplotlib).
+
+Only the modules a subcommand needs are imported, so numeric jobs never pay
+for matplotlib.
+"""
+
+import argparse
+import sys
+
+TRAIN_INPUT = "./data/games.csv"
+TEST_INPUT = "./data/test.csv"
+
+
+def rate(args):
+    import vello
+
+    teams, df = vello.load_games(args.csv, cache=args.cache)
+    elo_df = vello.record_games(df, teams, K=args.K, R=args.R,
+                                home_advantage=args.home_advantage)
+
+    for team in sorted(teams, key=lambda team: team.elo, reverse=True):
+        print("{:<24} {:>7.1f} {:>4}-{}".format(team.name, team.elo, team.wins,
+                                               team.losses))
+
+    if args.out:
+        elo_df.to_csv(args.out, index=False)
+
+
+def forecast(args):
+    import predict
+    import vello
+
+    teams, df = vello.load_games(args.train, cache=args.cache)
+    vello.record_games(df, teams, K=args.K, R=args.R,
+                       home_advantage=args.home_advantage)
+    _, test_df = vello.load_games(args.test)
+
+    kwargs = dict(seed=args.seed, K=args.K, R=args.R,
+                  home_advantage=args.home_advantage)
+    if args.tolerance is None and args.time_budget is None:
+        res = predict.summarize_season(test_df, teams, args.iterations,
+                                       workers=args.workers, **kwargs)
+    else:
+        res = predict.converge_season(test_df, teams, args.tolerance or 0,
+                                      max_iterations=args.iterations,
+                                      time_budget=args.time_budget, **kwargs)
+
+    columns = ["wins", "losses", "first_round", "second_round", "champs"]
+    summary = res.mean()[columns]
+    for column in ["first_round", "champs"]:
+        summary[column + "_stderr"] = res.stderr()[column]
+    print(summary.sort_values("champs", ascending=False).to_string())
+    print("{} iterations{}".format(res.iterations, "" if res.converged is None else
+                                   ", converged" if res.converged else ", not converged"))
+
+    if args.out:
+        summary.to_csv(args.out)
+
+
+def tune(args):
+    import tune as tuning
+
+    configs = tuning.grid(K=args.K, R=args.R, home_advantage=args.home_advantage)
+    res = tuning.tune(args.train, args.test, configs, out=args.out,
+                      workers=args.workers, iterations=args.iterations,
+                      seed=args.seed, prune=args.prune)
+
+    print(res.sort_values("playoff_brier", ascending=False).to_string(index=False))
+
+
+def plot(args):
+    import historical_plots
+
+    historical_plots.plot_history(args.start, args.stop, args.K, args.brier)
+
+
+def parser():
+    parser = argparse.ArgumentParser(description="Elo ratings for women's volleyball.")
+    parser.add_argument("--metrics", metavar="JSON",
+                        help="Time the hot paths and write the report to this file.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def elo_options(command, many=False):
+        nargs = "+" if many else None
+        command.add_argument("-K", type=float, nargs=nargs, default=[40] if many else 40,
+                             help="K-factor for Elo updating.")
+        command.add_argument("-R", type=float, nargs=nargs, default=[3] if many else 3,
+                             help="Regression proportion between seasons.")
+        command.add_argument("--home-advantage", type=float, nargs=nargs,
+                             default=[0] if many else 0,
+                             help="Additive Elo constant for home advantage.")
+
+    command = commands.add_parser("rate", help="Replay history and print current ratings.")
+    command.add_argument("csv", nargs="?", default=TRAIN_INPUT)
+    command.add_argument("--cache", action="store_true",
+                         help="Read matches through the columnar store.")
+    command.add_argument("--out", help="Write the matches with Elo columns to this CSV.")
+    elo_options(command)
+    command.set_defaults(func=rate)
+
+    command = commands.add_parser("forecast", help="Simulate a season.")
+    command.add_argument("train", nargs="?", default=TRAIN_INPUT)
+    command.add_argument("test", nargs="?", default=TEST_INPUT)
+    command.add_argument("-n", "--iterations", type=int, default=10000,
+                         help="Iterations, or the most to run with --tolerance.")
+    command.add_argument("--tolerance", type=float,
+                         help="Stop once playoff and title odds have this standard error.")
+    command.add_argument("--time-budget", type=float, metavar="SECONDS",
+                         help="Stop adaptive simulation after this long.")
+    command.add_argument("--workers", type=int, default=1)
+    command.add_argument("--seed", type=int)
+    command.add_argument("--cache", action="store_true",
+                         help="Read the training matches through the columnar store.")
+    command.add_argument("--out", help="Write the summary to this CSV.")
+    elo_options(command)
+    command.set_defaults(func=forecast)
+
+    command = commands.add_parser("tune", help="Grid search Elo hyperparameters.")
+    command.add_argument("train", nargs="?", default=TRAIN_INPUT)
+    command.add_argument("test", nargs="?", default=TEST_INPUT)
+    command.add_argument("-n", "--iterations", type=int, default=1000)
+    command.add_argument("--workers", type=int)
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--prune", type=float,
+                         help="Skip forecasts for configurations this far behind the best.")
+    command.add_argument("--out", help="Stream results to this CSV.")
+    elo_options(command, many=True)
+    command.set_defaults(func=tune)
+
+    command = commands.add_parser("plot", help="Plot historical Elo ratings.")
+    command.add_argument("start", type=int, help="Two-digit year to start analysis.")
+    command.add_argument("stop", type=int, help="Two-digit year to stop analysis.")
+    command.add_argument("-K", type=float, default=40)
+    command.add_argument("-b", "--brier", action="store_true", help="Plot Brier scores.")
+    command.set_defaults(func=plot)
+
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+
+    if args.metrics:
+        import metrics
+        metrics.enable()
+
+    args.func(args)
+
+    if args.metrics:
+        metrics.to_json(args.metrics)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
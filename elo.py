@@ -2,7 +2,13 @@ from itertools import combinations
 from numpy.random import normal, randint
 
 
+# Default Elo multipliers for matches that go 3, 4 and 5 sets.
+SET_MAP = {3: 1.2, 4: 1, 5: 0.9}
+
+
 class Team:
+    __slots__ = ("name", "elo", "wins", "losses")
+
     def __init__(self, name, elo):
         self.name = name
         self.elo = elo
@@ -17,6 +23,10 @@ class Team:
 
 
 class Match:
+    __slots__ = ("home", "away", "home_score", "away_score", "sets", "winner",
+                 "home_win_val", "home_advantage", "postseason",
+                 "postseason_multiplier", "K", "set_map", "set_factor")
+
     def __init__(self, home, away, home_score, away_score, **kwargs):
         """
             Supported kwargs:
@@ -45,7 +55,7 @@ class Match:
         self.postseason = kwargs.get("postseason", False)
         self.postseason_multiplier = kwargs.get("postseason_multiplier", 1.2)
         self.K = kwargs.get("K", 40)
-        self.set_map = kwargs.get("set_map", {3: 1.2, 4: 1, 5: 0.9})
+        self.set_map = kwargs.get("set_map", SET_MAP)
 
         self.set_factor = self.set_map[self.sets]
 
@@ -57,11 +67,6 @@ class Match:
 
     def home_elo_change(self):
         """Return the change in Elo for the home team from this match."""
-        if self.home_score == 3:
-            d = self.home.elo + self.home_advantage - self.away.elo
-        else:
-            d = self.away.elo - (self.home.elo + self.home_advantage)
-
         # Stolen from Nate Silver.
         # (Not the exact numbers.)
         # (https://fivethirtyeight.com/features/introducing-nfl-elo-ratings/)
@@ -81,6 +86,9 @@ class Match:
 
         Note that this could be called repeatedly with different effects each
         time.
+
+        The away team's change is computed after the home team's rating has
+        moved. Historical ratings depend on this, so keep it that way.
         """
         self.home.elo += self.home_elo_change()
         self.away.elo -= self.home_elo_change()
@@ -166,8 +174,9 @@ if __name__ == "__main__":
             else:
                 m = Match(home_team, away_team, randint(1, 3), 3)
 
-            home_team.elo += m.elo_change
-            away_team.elo -= m.elo_change
+            m.update_teams()
+
+    print(sorted((team for _, _, team in teams), key=lambda team: team.elo))
 
     # Wow! Works pretty well!
 
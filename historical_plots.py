@@ -1,57 +1,91 @@
 #!/usr/bin/env python3
 
-import matplotlib.pyplot as plt
-import seaborn as sns
 import argparse
-import matplotlib
-import volley_elo
+import history
+import scoring
 import plots
+import vello
 import math
 import pandas as pd
 import numpy as np
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Analyze the Elo of women's volleyball teams.")
-    parser.add_argument('start', metavar='start', type=int,
-                        help='Two-digit year to start analysis.')
-    parser.add_argument('stop', metavar='stop', type=int,
-                        help='Two-digit year to stop analysis.')
-    parser.add_argument('-K', type=int, nargs=1, default=40,
-                        help='K-factor for Elo updating. Defaults to 40.')
-    parser.add_argument('-b', '--brier', type=bool, nargs=1, default=False,
-                        help='Plot Brier scores.')
 
-    args = parser.parse_args()
+def record_predict(match_df):
+    """
+    Predict a home win whenever the home team has won at least as many
+    matches as the away team so far in `match_df`.
+
+    :returns: Series of 0/1 predictions aligned with `match_df`.
+
+    """
+    n = len(match_df)
+    home_won = match_df.home_won.to_numpy(bool)
+    long = pd.DataFrame({"team": np.concatenate([match_df.home.to_numpy(object),
+                                                 match_df.away.to_numpy(object)]),
+                         "won": np.concatenate([home_won, ~home_won]).astype(int),
+                         "order": np.tile(np.arange(n), 2)})
+
+    # Wins before each match: tally in match order, then drop the match itself.
+    long = long.sort_values("order", kind="stable")
+    before = (long.groupby("team").won.cumsum() - long.won).sort_index().to_numpy()
+
+    return pd.Series((before[:n] >= before[n:]).astype(int), index=match_df.index)
+
+
+def plot_history(start, stop, K=40, brier=False):
+    """
+    Plot the Elo history of the seasons from `start` to `stop`.
+
+    :start: Two-digit year to start analysis.
+    :stop: Two-digit year to stop analysis.
+    :K: K-factor for the main Elo ratings.
+    :brier: Also plot Brier scores.
 
-    dfs = {year: volley_elo.get_historical_df(year) for year in range(args.start, args.stop)}
+    """
+    # Only load the plotting libraries once a plot is actually requested.
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    import matplotlib
 
-    # Add Elo data to the dataframes.
-    # (Dictionary order is guaranteed to be insertion order in 3.7+.)
-    volley_elo.record_seasons(list(dfs.values()))
-    volley_elo.record_seasons(list(dfs.values()), K=100, elo_name="big-elo")
-    volley_elo.record_seasons(list(dfs.values()), K=600, elo_name="massive-elo")
-    volley_elo.record_seasons(list(dfs.values()), K=20, elo_name="small-elo")
+    _, all_df = vello.load_games(vello.GAMES_CSV)
+    seasons = vello.season_years(all_df)
+    all_df = all_df[(seasons >= 2000 + start) & (seasons < 2000 + stop)]
+
+    # Add Elo data for every season and K-factor in a single pass.
+    batch = vello.SeasonBatch(all_df.reset_index(drop=True))
+    batch.record({"elo": {"K": K}, "big-elo": {"K": 100},
+                  "massive-elo": {"K": 600}, "small-elo": {"K": 20}})
+    # Skip seasons without matches, like a range that runs past the data.
+    dfs = {year: batch.frame(2000 + year) for year in range(start, stop)
+           if 2000 + year in batch.bounds}
+    ratings = history.RatingHistory.from_matches(pd.concat(dfs.values()), "elo")
+
+    # The first two seasons only warm the ratings up.
+    plotted = [year for year in range(start + 2, stop) if year in dfs]
 
     n_cols = 3
-    n_rows = math.ceil((args.stop - args.start - 2) / float(n_cols))
+    n_rows = max(1, math.ceil(len(plotted) / float(n_cols)))
 
     matplotlib.rc('xtick', labelsize=5)
     matplotlib.rc('ytick', labelsize=5)
 
     sns.set()
-    fig, axes = plt.subplots(n_rows, n_cols)
+    fig, axes = plt.subplots(n_rows, n_cols, squeeze=False)
 
-    for year in range(args.start + 2, args.stop):
+    # Score every season and predictor at once.
+    all_df = pd.concat(dfs.values(), ignore_index=True)
+    years = np.repeat(list(dfs.keys()), [len(df) for df in dfs.values()])
+    totals = scoring.evaluate(all_df, "home_won", ["elo_win_prob", "big-elo_win_prob"],
+                              season=pd.Series(years))["totals"]
+
+    for k, year in enumerate(plotted):
         df = dfs[year]
 
-        brier = plots.brier_score(df, "home_won", "elo_win_prob")
-        brier2 = plots.brier_score(df, "home_won", "big-elo_win_prob")
-        print("20{}-{} Brier score:".format(year, year + 1), brier.sum())
-        print("20{}-{} Big Brier score:".format(year, year + 1), brier2.sum())
+        print("20{}-{} Brier score:".format(year, year + 1), totals.loc[year, "elo_win_prob"])
+        print("20{}-{} Big Brier score:".format(year, year + 1), totals.loc[year, "big-elo_win_prob"])
 
-        k = year - args.start - 2
         x, y = k // n_cols, k % n_cols
-        plots.plot_elo(df, ax=axes[x, y], elo_name="elo")
+        plots.plot_elo(df, ax=axes[x, y], elo_name="elo", history=ratings)
         axes[x, y].set_xlabel("")
         plt.sca(axes[x, y])
         plt.xticks(rotation=45)
@@ -64,12 +98,11 @@ if __name__ == "__main__":
     plt.subplots_adjust(wspace=0.32, hspace=0.49)
 
     # Brier score plots.
-    if args.brier:
-        for year in range(args.start + 2, args.stop):
+    if brier:
+        for year in plotted:
             fig = plt.figure()
             df = dfs[year]
-            df["random_choice"] = pd.DataFrame(np.random.randint(2, size=(len(df), 1)))
-            df["record_predict"] = (df["home_wins"] >= df["away_wins"]).apply(int)
+            df["record_predict"] = record_predict(df)
 
             plots.plot_brier(df, "home_won", "elo_win_prob", ax=plt.gca())
             plots.plot_brier(df, "home_won", "big-elo_win_prob", ax=plt.gca())
@@ -80,3 +113,19 @@ if __name__ == "__main__":
             plt.title("Brier scores for 20{}-{} season".format(year, year + 1))
 
     plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze the Elo of women's volleyball teams.")
+    parser.add_argument('start', metavar='start', type=int,
+                        help='Two-digit year to start analysis.')
+    parser.add_argument('stop', metavar='stop', type=int,
+                        help='Two-digit year to stop analysis.')
+    parser.add_argument('-K', type=int, default=40,
+                        help='K-factor for Elo updating. Defaults to 40.')
+    parser.add_argument('-b', '--brier', action='store_true',
+                        help='Plot Brier scores.')
+
+    args = parser.parse_args()
+
+    plot_history(args.start, args.stop, args.K, args.brier)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+Sparse Elo histories for many teams and seasons.
+
+A `RatingHistory` keeps only the ratings that were actually recorded: one
+(team, day, elo) point per team per day that it played. The points are held
+in compressed sparse row form, sorted by team and then by day:
+
+    days[offsets[t]:offsets[t + 1]]   Days that team t played, ascending.
+    elos[offsets[t]:offsets[t + 1]]   Its rating on each of those days.
+
+Point and range lookups are binary searches within a team's row. The dense
+date by team frame of `vello.team_elo_df` is only built by `dense`, for the
+teams and dates asked for.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _days(dates):
+    """Convert dates (anything `pd.to_datetime` takes) to integer day numbers."""
+    dates = pd.to_datetime(dates)
+    if isinstance(dates, pd.Timestamp):
+        return np.int64(dates.to_datetime64().astype("datetime64[D]").astype(np.int64))
+    return np.asarray(dates, dtype="datetime64[ns]").astype("datetime64[D]").astype(np.int64)
+
+
+def _dates(days):
+    return pd.to_datetime(np.asarray(days).astype("datetime64[D]"))
+
+
+class RatingHistory:
+    def __init__(self, names, offsets, days, elos):
+        """
+        :names: Team names, sorted; team t is `names[t]`.
+        :offsets: Array of len(names) + 1 row boundaries.
+        :days: Day numbers of every point, ascending within each team.
+        :elos: Rating at every point.
+
+        Use `from_matches` to build a history from a match dataframe.
+        """
+        self.names = list(names)
+        self.codes = {name: t for t, name in enumerate(self.names)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.days = np.asarray(days, dtype=np.int32)
+        self.elos = np.asarray(elos, dtype=float)
+
+        # Keys that sort every row after the one before it, so that one
+        # binary search covers any number of teams.
+        self._first = int(self.days.min()) if len(self.days) else 0
+        self._span = int(self.days.max()) - self._first + 2 if len(self.days) else 1
+        self._keys = self._key(self.days) + self._span * self._teams()
+
+    @classmethod
+    def from_matches(cls, match_df, elo_name="elo"):
+        """
+        Collect the ratings in the home and away Elo columns of `match_df`.
+
+        As in `vello.team_elo_df`, a team that plays more than once on a day
+        keeps its last rating of the day.
+        """
+        names = sorted(set(match_df.home) | set(match_df.away))
+        codes = {name: t for t, name in enumerate(names)}
+        n = len(match_df)
+
+        teams = np.concatenate([match_df.home.map(codes).to_numpy(np.int64),
+                                match_df.away.map(codes).to_numpy(np.int64)])
+        days = np.tile(_days(match_df.date), 2)
+        elos = np.concatenate([match_df["home_{}".format(elo_name)].to_numpy(float),
+                               match_df["away_{}".format(elo_name)].to_numpy(float)])
+        # Home before away within a match, like `vello._long_elo`.
+        order = np.concatenate([2 * np.arange(n), 2 * np.arange(n) + 1])
+
+        # `np.lexsort` sorts by the last key first.
+        sort = np.lexsort([order, days, teams])
+        teams, days, elos = teams[sort], days[sort], elos[sort]
+
+        last = np.ones(len(teams), dtype=bool)
+        last[:-1] = (teams[1:] != teams[:-1]) | (days[1:] != days[:-1])
+        teams, days, elos = teams[last], days[last], elos[last]
+
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(teams, minlength=len(names)))
+
+        return cls(names, offsets, days, elos)
+
+    def _key(self, days):
+        """Map day numbers into [0, span), 0 being before every point."""
+        return np.clip(np.asarray(days, dtype=np.int64) - self._first + 1, 0,
+                       self._span - 1)
+
+    def _teams(self):
+        """Return the team code of every point."""
+        return np.repeat(np.arange(len(self.names), dtype=np.int64),
+                         np.diff(self.offsets))
+
+    @property
+    def nbytes(self):
+        return (self.offsets.nbytes + self.days.nbytes + self.elos.nbytes
+                + self._keys.nbytes)
+
+    def _row(self, team):
+        t = self.codes[team]
+        return slice(self.offsets[t], self.offsets[t + 1])
+
+    def at(self, team, date):
+        """
+        Return the rating `team` last recorded on or before `date`, or NaN if
+        it had not played yet.
+        """
+        row = self._row(team)
+        k = np.searchsorted(self.days[row], _days(date), side="right") - 1
+        return self.elos[row][k] if k >= 0 else np.nan
+
+    def between(self, team, start=None, stop=None):
+        """
+        Return the ratings `team` recorded from `start` to `stop` (both
+        inclusive, either open if None) as a series indexed by date.
+        """
+        row = self._row(team)
+        days = self.days[row]
+        lo = 0 if start is None else np.searchsorted(days, _days(start), side="left")
+        hi = len(days) if stop is None else np.searchsorted(days, _days(stop), side="right")
+
+        return pd.Series(self.elos[row][lo:hi], index=_dates(days[lo:hi]), name=team)
+
+    def snapshot(self, date, teams=None):
+        """
+        Return every team's rating as of `date` (see `at`), as a series
+        indexed by team.
+
+        :teams: Teams to include. Defaults to every team.
+
+        """
+        teams = self.names if teams is None else list(teams)
+        codes = np.array([self.codes[team] for team in teams], dtype=np.int64)
+        starts = self.offsets[codes]
+
+        keys = self._key(_days(date)) + self._span * codes
+        k = np.searchsorted(self._keys, keys, side="right") - 1
+
+        played = k >= starts
+        values = np.full(len(teams), np.nan)
+        values[played] = self.elos[k[played]]
+        return pd.Series(values, index=teams, name=pd.Timestamp(date))
+
+    def dense(self, teams=None, start=None, stop=None):
+        """
+        Materialize a date by team frame like `vello.team_elo_df`.
+
+        The dates are every day from `start` to `stop` (inclusive) on which any
+        team played. Gaps are interpolated linearly by position and carried
+        forward after a team's last rating, as `team_elo_df` does, so the
+        frame for one season's dates matches `team_elo_df` of that season.
+
+        :teams: Teams to include. Defaults to every team that played in the
+                range.
+
+        """
+        lo = -np.inf if start is None else _days(start)
+        hi = np.inf if stop is None else _days(stop)
+        in_range = (self.days >= lo) & (self.days <= hi)
+        dates = np.unique(self.days[in_range])
+
+        if teams is None:
+            counts = np.bincount(self._teams()[in_range], minlength=len(self.names))
+            teams = [name for name, count in zip(self.names, counts) if count]
+
+        grid = np.arange(len(dates))
+        columns = {}
+        for team in sorted(teams):
+            row = self._row(team)
+            days, elos = self.days[row], self.elos[row]
+            keep = (days >= lo) & (days <= hi)
+            positions = np.searchsorted(dates, days[keep])
+
+            column = np.full(len(dates), np.nan)
+            if len(positions):
+                column = np.interp(grid, positions, elos[keep])
+                column[grid < positions[0]] = np.nan
+            columns[team] = column
+
+        return pd.DataFrame(columns, index=_dates(dates))
+
+    def save(self, path):
+        """Write the history to a .npz file."""
+        np.savez(path, names=np.array(self.names), offsets=self.offsets,
+                 days=self.days, elos=self.elos)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["names"].tolist(), data["offsets"], data["days"],
+                       data["elos"])
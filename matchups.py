@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""
+Answer questions about many matchups at once.
+
+A `RatingTable` holds a fixed set of ratings as an array. Queries take
+arrays of home and away teams (names or integer codes) and return NumPy
+arrays, so a slate of games, or every pairing of hundreds of teams, is one
+call rather than one `elo.win_prob` per pair.
+
+Set scores are modelled by treating every set as an independent coin flip
+with the probability that makes the best-of-five match probability equal the
+Elo win probability.
+"""
+
+import numpy as np
+import pandas as pd
+import vello
+import elo
+
+# Possible (home sets, away sets) results, in the order of `set_scores`.
+SCORES = [(3, 0), (3, 1), (3, 2), (2, 3), (1, 3), (0, 3)]
+
+
+def _match_prob(q):
+    """Probability of winning a best-of-five match, given set probability `q`."""
+    return q**3 * (1 + 3 * (1 - q) + 6 * (1 - q)**2)
+
+
+# Grid of set probabilities and the match probabilities they give, used to
+# start `set_prob` close to the answer.
+_GRID = np.linspace(0, 1, 1025)
+_GRID_PROBS = _match_prob(_GRID)
+
+
+def set_prob(p, steps=3):
+    """
+    Return the per-set win probability that gives match win probability `p`.
+
+    Works element-wise on arrays: a lookup in a precomputed grid followed by
+    a few Newton steps.
+    """
+    p = np.asarray(p, dtype=float)
+    q = np.interp(p, _GRID_PROBS, _GRID)
+
+    for _ in range(steps):
+        slope = 30 * q**2 * (1 - q)**2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            q = np.where(slope > 0, q - (_match_prob(q) - p) / slope, q)
+        q = np.clip(q, 0, 1)
+
+    return q
+
+
+class RatingTable:
+    def __init__(self, names, elos, K=40, home_advantage=0, set_map=None,
+                 postseason_multiplier=1, postseason=False):
+        """
+        :names: Team names; integer code k refers to `names[k]`.
+        :elos: Rating of each team.
+        :K: K-factor for Elo updating.
+        :home_advantage: Additive Elo constant for home advantage.
+        :set_map: Dictionary mapping number of sets (3, 4, 5) to constant Elo
+                  multiplier. Defaults to the `elo.Match` map.
+        :postseason_multiplier: Constant factor for postseason Elo changes.
+        :postseason: Price the Elo swings of postseason matches.
+
+        These are the parameters of `vello.record_games`, so that the swings
+        match how the ratings were computed.
+
+        """
+        self.names = list(names)
+        self.codes = {name: k for k, name in enumerate(self.names)}
+        self.elos = np.asarray(elos, dtype=float)
+        self.K = K
+        self.home_advantage = home_advantage
+        self.set_map = elo.SET_MAP if set_map is None else set_map
+        self.postseason_multiplier = postseason_multiplier
+        self.postseason = postseason
+
+    @classmethod
+    def from_teams(cls, teams, **kwargs):
+        """Build a table from `elo.Team` objects."""
+        teams = list(teams)
+        return cls([team.name for team in teams], [team.elo for team in teams],
+                   **kwargs)
+
+    @classmethod
+    def from_state(cls, rating_state):
+        """Build a table from the current ratings of a `state.RatingState`."""
+        params = rating_state.params
+        return cls(rating_state.names, rating_state.elos, K=params["K"],
+                   home_advantage=params["home_advantage"],
+                   set_map=params["set_map"],
+                   postseason_multiplier=params["postseason_multiplier"])
+
+    def lookup(self, teams):
+        """
+        Convert team names or integer codes to an array of codes.
+
+        :raises KeyError: For an unknown team name.
+
+        """
+        teams = np.asarray(teams)
+        if teams.dtype.kind in "iu":
+            return teams.astype(np.int64)
+
+        return np.vectorize(self.codes.__getitem__, otypes=[np.int64])(teams)
+
+    def win_prob(self, home, away):
+        """Return the home win probability of every matchup, like `elo.win_prob`."""
+        d = self.elos[self.lookup(home)] + self.home_advantage - self.elos[self.lookup(away)]
+        return 1 / (1 + 10**(-d / 400))
+
+    def set_scores(self, home, away):
+        """
+        Return the probability of every set score of every matchup.
+
+        :returns: Array with one more axis than `home`, of length 6, ordered
+                  like `SCORES`.
+
+        """
+        q = set_prob(self.win_prob(home, away))
+        r = 1 - q
+        return np.stack([q**3, 3 * q**3 * r, 6 * q**3 * r**2,
+                         6 * r**3 * q**2, 3 * r**3 * q, r**3], axis=-1)
+
+    def elo_changes(self, home, away):
+        """
+        Return the Elo change of the home and away teams for every set score
+        of every matchup, as `vello.record_games` would apply it.
+
+        :returns: Tuple of (home change, away change) arrays shaped like the
+                  output of `set_scores`.
+
+        """
+        home_elo = self.elos[self.lookup(home)][..., None]
+        away_elo = self.elos[self.lookup(away)][..., None]
+
+        won = np.array([float(h == 3) for h, a in SCORES])
+        factor = np.array(vello._factors([h + a for h, a in SCORES],
+                                         [self.postseason] * len(SCORES), self.K,
+                                         self.set_map, self.postseason_multiplier))
+
+        # The away team's change is computed after the home team has moved.
+        d = home_elo + self.home_advantage - away_elo
+        home_change = factor * (won - 1 / (1 + 10**(-d / 400)))
+
+        d = home_elo + home_change + self.home_advantage - away_elo
+        away_change = -factor * (won - 1 / (1 + 10**(-d / 400)))
+
+        return home_change, away_change
+
+    def query(self, home, away):
+        """
+        Answer everything about a slate of matchups at once.
+
+        :home: Array of home teams, as names or codes.
+        :away: Array of away teams, the same shape as `home`.
+        :returns: Dictionary of arrays:
+
+            "win_prob": home win probability.
+            "set_scores": probability of each set score (see `set_scores`).
+            "home_change", "away_change": Elo change for each set score
+                                          (see `elo_changes`).
+            "expected_home_change": mean home Elo change.
+            "expected_swing": mean absolute home Elo change.
+
+        """
+        home, away = self.lookup(home), self.lookup(away)
+        scores = self.set_scores(home, away)
+        home_change, away_change = self.elo_changes(home, away)
+
+        return {"win_prob": self.win_prob(home, away), "set_scores": scores,
+                "home_change": home_change, "away_change": away_change,
+                "expected_home_change": (scores * home_change).sum(axis=-1),
+                "expected_swing": (scores * np.abs(home_change)).sum(axis=-1)}
+
+    def matrix(self, teams=None, field="win_prob"):
+        """
+        Return `field` of `query` for every pairing of `teams`, with home
+        teams as rows and away teams as columns.
+
+        :teams: Teams to include. Defaults to every team.
+
+        """
+        teams = self.names if teams is None else list(teams)
+        codes = self.lookup(teams)
+        home, away = np.meshgrid(codes, codes, indexing="ij")
+
+        if field == "win_prob":
+            values = self.win_prob(home, away)
+        else:
+            values = self.query(home, away)[field]
+
+        if values.ndim > 2:
+            raise ValueError("{} has more than one value per matchup.".format(field))
+
+        labels = [self.names[code] for code in codes]
+        return pd.DataFrame(values, index=labels, columns=labels)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+"""
+Opt-in timers and counters for the hot paths.
+
+Instrumentation is off by default; `timer` then returns a shared no-op
+context manager, so the cost of an instrumented call is one function call.
+Turn it on with `enable()` or by setting VELLO_METRICS=1 in the environment.
+
+    import metrics
+    metrics.enable()
+    ...
+    print(metrics.report())
+
+Each timed phase records its number of calls, total time, items processed
+(matches, iterations, ...), net allocated memory blocks and a latency
+histogram with power-of-two microsecond buckets. Timings from worker
+processes stay in those processes.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+enabled = os.environ.get("VELLO_METRICS", "") not in ("", "0")
+
+_lock = threading.Lock()
+_phases = dict()
+_counters = dict()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Forget everything recorded so far."""
+    with _lock:
+        _phases.clear()
+        _counters.clear()
+
+
+class _NullTimer:
+    """Stand-in returned by `timer` while instrumentation is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("name", "items", "start", "blocks")
+
+    def __init__(self, name, items):
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        blocks = sys.getallocatedblocks() - self.blocks
+        _record(self.name, elapsed, self.items, blocks)
+        return False
+
+
+def timer(name, items=0):
+    """
+    Time a phase.
+
+    :name: Phase name, like "record_games".
+    :items: Number of items the phase processes. Can also be set on the
+            returned object inside the `with` block once it is known.
+
+    """
+    if not enabled:
+        return _NULL
+    return _Timer(name, items)
+
+
+def count(name, n=1):
+    """Add `n` to a counter."""
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def _record(name, elapsed, items, blocks):
+    bucket = max(0, int(math.log2(max(elapsed * 1e6, 1))))
+    with _lock:
+        phase = _phases.setdefault(name, {"calls": 0, "seconds": 0.0, "items": 0,
+                                          "allocated_blocks": 0, "histogram": {}})
+        phase["calls"] += 1
+        phase["seconds"] += elapsed
+        phase["items"] += items
+        phase["allocated_blocks"] += blocks
+        phase["histogram"][bucket] = phase["histogram"].get(bucket, 0) + 1
+
+
+def _quantile(histogram, calls, q):
+    """Upper bound, in seconds, of the histogram bucket holding quantile `q`."""
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= q * calls:
+            return 2**(bucket + 1) / 1e6
+    return math.nan
+
+
+def report():
+    """Return everything recorded so far as a JSON-serializable dictionary."""
+    with _lock:
+        phases = {name: dict(phase, histogram=dict(phase["histogram"]))
+                  for name, phase in _phases.items()}
+        counters = dict(_counters)
+
+    for phase in phases.values():
+        seconds, calls = phase["seconds"], phase["calls"]
+        phase["items_per_second"] = phase["items"] / seconds if seconds else math.nan
+        phase["mean_seconds"] = seconds / calls
+        for q in [0.5, 0.9, 0.99]:
+            phase["p{}_seconds".format(int(100 * q))] = _quantile(phase["histogram"],
+                                                                 calls, q)
+        # JSON keys must be strings; label buckets by their upper bound.
+        phase["histogram"] = {"<{}us".format(2**(bucket + 1)): n
+                              for bucket, n in sorted(phase["histogram"].items())}
+
+    return {"phases": phases, "counters": counters}
+
+
+def to_json(path):
+    """Write `report()` to a JSON file."""
+    with open(path, "w") as f:
+        json.dump(report(), f, indent=2)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(report()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=9100, host="127.0.0.1"):
+    """
+    Serve `report()` as JSON over HTTP from a background thread.
+
+    :returns: The server; call `shutdown()` on it to stop.
+
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
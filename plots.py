@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 
-from volley_elo import team_elo_df
+from vello import team_elo_df
 from elo import brier_score
 
 
-def plot_elo(match_df, ax, elo_name="elo", teams=None, add_markers=True):
+def plot_elo(match_df, ax, elo_name="elo", teams=None, add_markers=True,
+             history=None):
     """Plot an Elo time-series on the given axis for the given teams.
 
     :match_df: A match dataframe.
@@ -12,6 +13,9 @@ def plot_elo(match_df, ax, elo_name="elo", teams=None, add_markers=True):
     :elo_name: Name that the elo columns in `match_df`.
     :teams: A list of team names to plot, or None if all teams should be plotted.
     :add_markers: Add postseason and average markers.
+    :history: Optional `history.RatingHistory` of `elo_name` covering
+              `match_df`'s dates, to read the ratings from instead of
+              rebuilding them from `match_df`.
 
     `add_markers` is useful if you want to plot multiple versions of Elo in the
     same plot. You wouldn't want duplicate labels of the postseason and average
@@ -19,7 +23,10 @@ def plot_elo(match_df, ax, elo_name="elo", teams=None, add_markers=True):
     can use this one if you like.)
     """
     year = match_df.iloc[0].date.year
-    df = team_elo_df(match_df, elo_name=elo_name)
+    if history is not None:
+        df = history.dense(teams or None, match_df.date.min(), match_df.date.max())
+    else:
+        df = team_elo_df(match_df, elo_name=elo_name)
 
     if teams:
         df = df[teams]
@@ -50,11 +57,11 @@ def plot_brier(df, result_col, predict_col, ax):
 
 
 if __name__ == "__main__":
-    import volley_elo
+    import vello
     import matplotlib.pyplot as plt
-    dfs = {year: volley_elo.get_historical_df(year) for year in range(12, 20)}
-    volley_elo.record_seasons(list(dfs.values()))
-    volley_elo.record_seasons(list(dfs.values()), K=100, elo_name="big-elo")
+    dfs = {year: vello.get_historical_df(year) for year in range(12, 20)}
+    vello.record_seasons(list(dfs.values()))
+    vello.record_seasons(list(dfs.values()), K=100, elo_name="big-elo")
     plt.figure()
     plot_elo(dfs[19], plt.gca(), "elo", ["Birmingham-Southern"], add_markers=False)
     plot_elo(dfs[19], plt.gca(), "big-elo", ["Birmingham-Southern"], ["Big Elo BSC"])
@@ -1,166 +1,673 @@
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+import time
 import pandas as pd
-import random
+import numpy as np
+from bracket import TOP_FOUR
+import metrics
 import vello
-import copy
 import elo
 
 TRAIN_INPUT = "./data/games.csv"
 TEST_INPUT = "./data/test.csv"
 
-def predict_season(match_df, teams, iterations=1, regress=True, **kwargs):
+# Order of the per-team statistics in the result dataframe.
+FIELDS = ["elo", "wins", "seed", "first_round", "second_round", "champs",
+          "pct", "losses"]
+
+
+def _update_factor(**kwargs):
     """
-    Simulate the matches described by `match_df` using the teams from a given
-    dictionary.
+    Return the Elo update factor that `elo.Match` would use for a simulated
+    game.
+
+    Every simulated game is recorded as a 3-1 win (see the note in
+    `predict_season`), so the factor is the same for every game.
+    """
+    K = kwargs.get("K", 40)
+    set_map = kwargs.get("set_map", elo.SET_MAP)
+
+    factor = K * set_map[4]
+
+    if kwargs.get("postseason", False):
+        factor *= 1.3
+
+    return factor
+
 
+def _play(elos, home, away, draws, factor, home_advantage=0, draw_advantage=0):
     """
-    R = kwargs.get("R", 3)
+    Play one game in every simulated season at once.
+
+    :elos: (iterations, teams) array of Elo ratings. Modified in place.
+    :home: Column of the home team, or an array of columns (one per row).
+    :away: Column of the away team, or an array of columns (one per row).
+    :draws: Uniform random draws, one per row.
+    :factor: Elo update factor from `_update_factor`.
+    :home_advantage: Additive Elo constant for home advantage.
+    :draw_advantage: Elo bonus for the home team when drawing the winner.
+    :returns: Boolean array, True where the home team won.
+
+    This mirrors `elo.Match.update_teams`: the winner is drawn without home
+    advantage (unless `draw_advantage` is given), and the away team's change
+    is computed after the home team's rating has already moved.
+    """
+    rows = np.arange(len(elos))
+    home_elo = elos[rows, home]
+    away_elo = elos[rows, away]
+
+    won = draws < 1 / (1 + 10**(-(home_elo + draw_advantage - away_elo) / 400))
+    home_win_val = won.astype(float)
+
+    d = home_elo + home_advantage - away_elo
+    home_elo = home_elo + factor * (home_win_val - 1 / (1 + 10**(-d / 400)))
+
+    d = home_elo + home_advantage - away_elo
+    away_elo = away_elo - factor * (home_win_val - 1 / (1 + 10**(-d / 400)))
+
+    elos[rows, home] = home_elo
+    elos[rows, away] = away_elo
+
+    return won
+
+
+def _simulate(start_elo, home, away, draws, bracket=TOP_FOUR, outcomes=False,
+              **kwargs):
+    """
+    Simulate a regular season and postseason for every iteration at once.
+
+    :start_elo: Preseason Elo of each team.
+    :home: Column index of the home team for each regular season match.
+    :away: Column index of the away team for each regular season match.
+    :draws: (iterations, len(home) + bracket.n_games) array of uniform draws.
+            The last columns decide the postseason.
+    :bracket: `bracket.Bracket` describing the postseason.
+    :outcomes: If True, also return the (iterations, matches) boolean array
+               of regular season home wins under "outcomes".
+    :returns: Dictionary mapping each statistic in `FIELDS` to an
+              (iterations, teams) array.
+
+    """
+    iterations = len(draws)
+    n_teams = len(start_elo)
+    factor = _update_factor(**kwargs)
+    home_advantage = kwargs.get("home_advantage", 0)
+
+    elos = np.tile(np.asarray(start_elo, dtype=float), (iterations, 1))
+    wins = np.zeros((iterations, n_teams), dtype=np.int64)
+    losses = np.zeros((iterations, n_teams), dtype=np.int64)
+    home_won = np.zeros((iterations, len(home) if outcomes else 0), dtype=bool)
+
+    with metrics.timer("predict.regular_season", iterations):
+        for k, (h, a) in enumerate(zip(home, away)):
+            won = _play(elos, h, a, draws[:, k], factor, home_advantage)
+            if outcomes:
+                home_won[:, k] = won
+            wins[:, h] += won
+            losses[:, a] += won
+            wins[:, a] += ~won
+            losses[:, h] += ~won
+
+    season_elo = elos.copy()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = wins / (wins + losses)
+
+    def play(home, away, draws, draw_advantage):
+        return _play(elos, home, away, draws, factor, home_advantage, draw_advantage)
+
+    # Handle the postseason.
+    # It LOOKS LIKE this is the ranking: win-loss differential, with ties
+    # broken by the bracket's tiebreakers and then the original team order.
+    with metrics.timer("predict.postseason", iterations):
+        rows = np.arange(iterations)[:, None]
+        rankings = bracket.rank(wins, losses, {"elo": season_elo, "wins": wins, "pct": pct})
+
+        seed = np.empty((iterations, n_teams), dtype=np.int64)
+        seed[rows, rankings] = np.arange(1, n_teams + 1)
+
+        reached = bracket.simulate(rankings, draws[:, len(home):], play)
+
+    results = {"elo": season_elo, "wins": wins, "seed": seed,
+               "first_round": reached >= 1, "second_round": reached >= 2,
+               "champs": reached == len(bracket.rounds) + 1, "pct": pct,
+               "losses": losses}
+
+    if outcomes:
+        results["outcomes"] = home_won
+
+    return results
+
+
+def _uniforms(rng, iterations, columns, antithetic=False):
+    """
+    Draw an (iterations, columns) array of uniforms from `rng`.
+
+    :antithetic: If True, only the first half of the rows is drawn and the
+                 second half is its mirror image, 1 - u. A season simulated
+                 from the mirrored draws tends to go the other way, which
+                 cancels much of the noise in averages over both.
+
+    """
+    if not antithetic:
+        return rng.random((iterations, columns))
+
+    half = rng.random(((iterations + 1) // 2, columns))
+    return np.concatenate([half, 1 - half])[:iterations]
 
+
+def common_draws(match_df, iterations, seed=None, bracket=TOP_FOUR,
+                 antithetic=False):
+    """
+    Draw a block of uniforms to share between simulations of `match_df`.
+
+    Passing the same block as `draws` to `simulate`, `predict_season` or
+    `summarize_season` for different parameters (K-factors, ratings,
+    scenarios) plays every configuration against the same luck, so their
+    differences are not swamped by simulation noise.
+
+    :returns: (iterations, regular season matches + bracket.n_games) array.
+
+    """
+    n_regular = int((~match_df.postseason.astype(bool)).sum())
+    return _uniforms(np.random.default_rng(seed), iterations,
+                     n_regular + bracket.n_games, antithetic)
+
+
+def _streams(seed, workers):
+    """
+    Return one random stream (anything `numpy.random.default_rng` takes) per
+    worker.
+
+    A single worker draws from `seed` itself, so an integer seed gives the
+    same stream as `numpy.random.default_rng(seed)` and a Generator is used
+    (and advanced) directly. Several workers get independent child streams
+    spawned from `seed`.
+    """
+    if workers == 1:
+        return [seed]
+
+    if isinstance(seed, np.random.Generator):
+        return seed.spawn(workers)
+
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    return seed.spawn(workers)
+
+
+def _check_draws(draws, home, bracket):
+    columns = len(home) + bracket.n_games
+    if draws.ndim != 2 or draws.shape[1] != columns:
+        raise ValueError("Expected draws with {} columns, got shape {}."
+                         .format(columns, draws.shape))
+
+
+def _simulate_chunk(start_elo, home, away, iterations, seed, bracket, outcomes,
+                    kwargs, antithetic=False, draws=None):
+    """
+    Simulate `iterations` seasons with draws from their own random stream,
+    or with the given `draws`.
+
+    This is the unit of work handed to each worker process.
+    """
+    if draws is None:
+        rng = np.random.default_rng(seed)
+        draws = _uniforms(rng, iterations, len(home) + bracket.n_games, antithetic)
+
+    return _simulate(start_elo, home, away, draws, bracket, outcomes, **kwargs)
+
+
+def _prepare(match_df, teams, regress=True, R=3):
+    """
+    Set up the arrays that a simulation of `match_df` needs.
+
+    :returns: Tuple of (team names, preseason Elos, regular season dataframe,
+              home team columns, away team columns).
+
+    """
     # Only look at teams which actually appear in the season.
     teams = {team.name: team for team in teams if
                 team.name in match_df.home.values or
                 team.name in match_df.away.values}
 
-    data = {name:
-            {"elo": [], "wins": [], "seed": [], "first_round": [],
-                "second_round": [], "champs": [], "pct": [],
-                 "losses": []} for name in teams.keys()}
-
-
-    for _ in range(iterations):
-        matches_df = match_df.copy()
-        new_teams = copy.deepcopy(teams)
-
-        for team in new_teams.values():
-            team.wins = 0
-            team.losses = 0
-            if regress:
-                team.elo -= (team.elo - 1500) / R
-
-        for match in matches_df.itertuples():
-            if match.postseason:
-                # Don't handle scheduled postseason matches.
-                # (If you pass in a historical year where postseason matches
-                # are included, we want to skip those.)
-                continue
-
-            home = new_teams[match.home]
-            away = new_teams[match.away]
-
-            """
-            Okay, I'm about to do something super hack-y here.
-
-            Matches give an extra 20% weight to total beatdowns, and I'm not
-            sure what's the best way to predict the "spread" based on Elo yet.
-            (538 does something for the NFL, go check it out.) For now, I'm
-            just going to say that every victory is a nice 3-1 win, which *as
-            of right now* (2020-04-26 00:14) leaves its value unmodified.
-
-            My point is that the score here is totally arbitrary, and I really
-            want to say "just don't look at the score."
-            """
-            win_prob = elo.win_prob(home, away)
-            if random.random() < win_prob:
-                # Home team won.
-                match = elo.Match(home, away, 3, 1, **kwargs)
-            else:
-                # Away team won.
-                match = elo.Match(home, away, 1, 3, **kwargs)
-
-            match.update_teams()
-
-        for name, team in new_teams.items():
-            data[name]["elo"].append(team.elo)
-            data[name]["wins"].append(team.wins)
-            data[name]["losses"].append(team.losses)
-            data[name]["pct"].append(team.wins / (team.wins + team.losses))
-
-        # Handle the postseason.
-        # For now (2021-06-22 23:18) we're going to use the 2020 playoff rules:
-        # Top 4 seeds play each other in a tournament.
-
-        # It LOOKS LIKE this is the ranking.
-        rank = lambda name: data[name]["wins"][-1] - data[name]["losses"][-1]
-        rankings = sorted(list(new_teams.keys()), key=rank, reverse=True)
-        top_4 = rankings[:4]
-        for k, name in enumerate(rankings):
-            data[name]["first_round"].append(False)
-            data[name]["second_round"].append(False)
-            data[name]["champs"].append(False)
-            data[name]["seed"].append(k + 1)
-
-        for name in top_4:
-            data[name]["first_round"][-1] = True
-
-        one = new_teams[top_4[0]]
-        two = new_teams[top_4[1]]
-        three = new_teams[top_4[-2]]
-        four = new_teams[top_4[-1]]
-
-        # Simulate 1-4.
-        if random.random() < elo.win_prob(one, four):
-            data[top_4[0]]["second_round"][-1] = True
-            one_winner = top_4[0]
-            elo.Match(one, four, 3, 1, **kwargs).update_teams()
-        else:
-            data[top_4[-1]]["second_round"][-1] = True
-            one_winner = top_4[-1]
-            elo.Match(one, four, 1, 3, **kwargs).update_teams()
-
-        # Simulate 2-3.
-        if random.random() < elo.win_prob(two, three):
-            data[top_4[1]]["second_round"][-1] = True
-            two_winner = top_4[1]
-            elo.Match(two, three, 3, 1, **kwargs).update_teams()
-        else:
-            data[top_4[-2]]["second_round"][-1] = True
-            two_winner = top_4[-2]
-            elo.Match(two, three, 1, 3, **kwargs).update_teams()
+    # Sort the names so that column order, and with it how `Bracket.rank`
+    # breaks ties, doesn't depend on the order of `teams`.
+    names = sorted(teams)
+    columns = {name: k for k, name in enumerate(names)}
 
-        new_one = new_teams[one_winner]
-        new_two = new_teams[two_winner]
+    start_elo = np.array([teams[name].elo for name in names], dtype=float)
+    if regress:
+        start_elo -= (start_elo - 1500) / R
 
-        # Simulate the championship.
-        if random.random() < elo.win_prob(new_one, new_two):
-            data[one_winner]["champs"][-1] = True
-            elo.Match(new_one, new_two, 3, 1, **kwargs).update_teams()
-        else:
-            data[two_winner]["champs"][-1] = True
-            elo.Match(new_one, new_two, 1, 3, **kwargs).update_teams()
+    # Don't handle scheduled postseason matches.
+    # (If you pass in a historical year where postseason matches are included,
+    # we want to skip those.)
+    regular_df = match_df[~match_df.postseason.astype(bool)]
+    home = regular_df.home.map(columns).to_numpy()
+    away = regular_df.away.map(columns).to_numpy()
+
+    return names, start_elo, regular_df, home, away
+
+
+def simulate(match_df, teams, iterations=1, regress=True, seed=None, workers=1,
+             bracket=TOP_FOUR, outcomes=False, antithetic=False, draws=None,
+             **kwargs):
+    """
+    Simulate a season like `predict_season`, but return the raw arrays.
+
+    :outcomes: If True, also keep the per-iteration result of every regular
+               season match (see `_simulate`).
+    :antithetic: Pair every season with one played from mirrored draws (see
+                 `_uniforms`). Pairs are formed within each worker.
+    :draws: Optional block of uniforms from `common_draws` to use instead of
+            fresh ones. `iterations` and `seed` are then ignored.
+    :returns: Tuple of (team names, regular season dataframe, dictionary of
+              (iterations, teams) arrays keyed by statistic).
+
+    """
+    names, start_elo, regular_df, home, away = _prepare(match_df, teams, regress,
+                                                        kwargs.get("R", 3))
+
+    """
+    Okay, I'm about to do something super hack-y here.
+
+    Matches give an extra 20% weight to total beatdowns, and I'm not sure
+    what's the best way to predict the "spread" based on Elo yet. (538 does
+    something for the NFL, go check it out.) For now, I'm just going to say
+    that every victory is a nice 3-1 win, which *as of right now* (2020-04-26
+    00:14) leaves its value unmodified.
+
+    My point is that the score here is totally arbitrary, and I really want to
+    say "just don't look at the score."
+    """
+    if draws is not None:
+        _check_draws(draws, home, bracket)
+        iterations = len(draws)
+
+    seeds = _streams(seed, workers)
+    sizes = [len(chunk) for chunk in np.array_split(np.arange(iterations), workers)]
+    offsets = np.cumsum([0] + sizes[:-1]).tolist()
+    args = [(start_elo, home, away, size, child, bracket, outcomes, kwargs,
+             antithetic, None if draws is None else draws[offset:offset + size])
+            for size, child, offset in zip(sizes, seeds, offsets)]
+
+    if workers == 1:
+        parts = [_simulate_chunk(*args[0])]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(_simulate_chunk, *zip(*args)))
+
+    # Merge the workers' results back together, in worker order.
+    results = {field: np.concatenate([part[field] for part in parts])
+               for field in parts[0]}
+
+    return names, regular_df, results
+
+
+def predict_season(match_df, teams, iterations=1, regress=True, seed=None,
+                   workers=1, bracket=TOP_FOUR, antithetic=False, draws=None,
+                   **kwargs):
+    """
+    Simulate the matches described by `match_df` using the teams from a given
+    dictionary.
+
+    All iterations are simulated together: the Elo ratings are held in an
+    (iterations, teams) array and every scheduled match is played in all
+    iterations at once.
+
+    :seed: Integer seed, `numpy.random.SeedSequence` or
+           `numpy.random.Generator` for the random draws.
+    :workers: Number of processes to split the iterations across.
+    :bracket: `bracket.Bracket` describing the postseason. Defaults to the
+              2020 top four format. "first_round" means making the bracket,
+              "second_round" means reaching its second round.
+
+    With one worker the draws come straight from `seed`; with more, each
+    worker gets its own stream spawned from it (see `_streams`). Results are
+    reproducible for a given (seed, workers) pair. See `simulate` for
+    `antithetic` and `draws`.
+
+    """
+    names, _, results = simulate(match_df, teams, iterations, regress, seed,
+                                 workers, bracket, antithetic=antithetic,
+                                 draws=draws, **kwargs)
 
     # Turn the results into a MultiIndex dataframe.
+    with metrics.timer("predict.frame", iterations):
+        reform = {(name, field): results[field][:, k]
+                  for k, name in enumerate(names) for field in FIELDS}
+        res = pd.DataFrame(reform)
+
+    return names, res
 
-    # Borrowed from: https://stackoverflow.com/a/24988227/6670539
-    reform = {(outer_key, inner_key): values for outer_key, inner_dict in data.items() for inner_key, values in inner_dict.items()}
 
-    return list(teams.keys()), pd.DataFrame(reform)
+# Elo grid for the quantile sketch in `SeasonSummary`, one bin per point.
+ELO_RANGE = (0, 3000)
+
+# Compact on-disk record of one simulated season (see `summarize_season`).
+DUMP_TYPES = {"elo": "f4", "wins": "u2", "losses": "u2", "seed": "u2",
+              "pct": "f4", "first_round": "?", "second_round": "?",
+              "champs": "?"}
+
+
+class SeasonSummary:
+    """
+    Running aggregates of simulated seasons, in fixed-size arrays.
+
+    The memory used depends on the number of teams and matches, not on the
+    number of iterations, so batches of results can be folded in with
+    `update` and summaries from different workers combined with `merge`.
+    """
+
+    def __init__(self, names, n_matches):
+        """
+        :names: Names of the simulated teams, in column order.
+        :n_matches: Number of regular season matches, which bounds each team's
+                    wins.
+
+        """
+        self.names = list(names)
+        n_teams = len(self.names)
+
+        self.iterations = 0
+        # Set by `converge_season`: whether the requested tolerance was met.
+        self.converged = None
+        self.counts = {field: np.zeros(n_teams, dtype=np.int64) for field in FIELDS}
+        self.sums = {field: np.zeros(n_teams) for field in FIELDS}
+        self.squares = {field: np.zeros(n_teams) for field in FIELDS}
+        self.seed_counts = np.zeros((n_teams, n_teams), dtype=np.int64)
+        self.win_counts = np.zeros((n_teams, n_matches + 1), dtype=np.int64)
+        self.elo_counts = np.zeros((n_teams, ELO_RANGE[1] - ELO_RANGE[0]),
+                                   dtype=np.int64)
+
+    def _bincount(self, values, counts):
+        """Add a (iterations, teams) array of bins to a per-team histogram."""
+        n_teams, n_bins = counts.shape
+        bins = values + n_bins * np.arange(n_teams)
+        counts += np.bincount(bins.ravel(), minlength=counts.size).reshape(counts.shape)
+
+    def update(self, results):
+        """Fold in a dictionary of (iterations, teams) arrays from `_simulate`."""
+        self.iterations += len(results["wins"])
+
+        for field in FIELDS:
+            values = results[field].astype(float)
+            valid = ~np.isnan(values)
+            self.counts[field] += valid.sum(axis=0)
+            self.sums[field] += np.where(valid, values, 0).sum(axis=0)
+            self.squares[field] += np.where(valid, values**2, 0).sum(axis=0)
+
+        self._bincount(results["seed"] - 1, self.seed_counts)
+        self._bincount(results["wins"], self.win_counts)
+
+        elo_bins = np.clip(results["elo"], ELO_RANGE[0], ELO_RANGE[1] - 1) - ELO_RANGE[0]
+        self._bincount(elo_bins.astype(np.int64), self.elo_counts)
+
+    def merge(self, other):
+        """Add the aggregates of another summary of the same teams."""
+        self.iterations += other.iterations
+        for field in FIELDS:
+            self.counts[field] += other.counts[field]
+            self.sums[field] += other.sums[field]
+            self.squares[field] += other.squares[field]
+        self.seed_counts += other.seed_counts
+        self.win_counts += other.win_counts
+        self.elo_counts += other.elo_counts
+
+    def mean(self):
+        """
+        Return the mean of every statistic, with one row per team and one
+        column per field (like `predict_season(...).mean().unstack()`).
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.DataFrame({field: self.sums[field] / self.counts[field]
+                                 for field in FIELDS}, index=self.names)
+
+    def std(self):
+        """Return the standard deviation of every statistic, like `mean`."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = {field: self.sums[field] / self.counts[field] for field in FIELDS}
+            return pd.DataFrame({field: np.sqrt(np.maximum(
+                                    self.squares[field] / self.counts[field]
+                                    - means[field]**2, 0))
+                                 for field in FIELDS}, index=self.names)
+
+    def stderr(self):
+        """
+        Return the Monte Carlo standard error of every mean in `mean`. For the
+        boolean statistics this is sqrt(p(1 - p) / n).
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.std() / np.sqrt(pd.DataFrame(self.counts, index=self.names))
+
+    def seeds(self):
+        """Return the probability of each team (rows) finishing at each seed."""
+        return pd.DataFrame(self.seed_counts / self.iterations, index=self.names,
+                            columns=range(1, len(self.names) + 1))
+
+    def wins(self):
+        """Return the probability of each team (rows) winning each number of games."""
+        return pd.DataFrame(self.win_counts / self.iterations, index=self.names)
+
+    def elo_quantiles(self, quantiles=(0.05, 0.5, 0.95)):
+        """
+        Return quantiles of each team's end-of-season Elo, read off the
+        histogram to within a point.
+        """
+        cumulative = np.cumsum(self.elo_counts, axis=1)
+        table = {}
+        for q in quantiles:
+            target = q * self.iterations
+            bins = np.array([np.searchsorted(row, target) for row in cumulative])
+            bins = np.minimum(bins, cumulative.shape[1] - 1)
+            rows = np.arange(len(self.names))
+            counts = self.elo_counts[rows, bins]
+            below = cumulative[rows, bins] - counts
+            with np.errstate(divide="ignore", invalid="ignore"):
+                fraction = np.where(counts > 0, (target - below) / counts, 0)
+            table[q] = ELO_RANGE[0] + bins + fraction
+
+        return pd.DataFrame(table, index=self.names)
+
+
+def _summarize_chunk(names, start_elo, home, away, iterations, seed, bracket,
+                     batch_size, dump, offset, kwargs, antithetic=False,
+                     draws=None):
+    """
+    Simulate `iterations` seasons in batches and summarize them.
+
+    Consecutive batches read consecutive draws from the same random stream
+    (or consecutive rows of `draws`), so without `antithetic` the seasons are
+    the ones `_simulate_chunk` would play with `seed`. With it, seasons are
+    paired within each batch.
+    """
+    rng = np.random.default_rng(seed)
+    summary = SeasonSummary(names, len(home))
+    out = None if dump is None else np.load(dump, mmap_mode="r+")
+
+    for start in range(0, iterations, batch_size):
+        size = min(batch_size, iterations - start)
+        if draws is None:
+            batch = _uniforms(rng, size, len(home) + bracket.n_games, antithetic)
+        else:
+            batch = draws[start:start + size]
+        results = _simulate(start_elo, home, away, batch, bracket, **kwargs)
+        summary.update(results)
+
+        if out is not None:
+            rows = slice(offset + start, offset + start + size)
+            for field in DUMP_TYPES:
+                out[field][rows] = results[field]
+
+    if out is not None:
+        out.flush()
+
+    return summary
+
+
+def summarize_season(match_df, teams, iterations=1, regress=True, seed=None,
+                     workers=1, bracket=TOP_FOUR, batch_size=10000, dump=None,
+                     antithetic=False, draws=None, **kwargs):
+    """
+    Simulate a season like `predict_season`, but keep only running aggregates.
+
+    Iterations are simulated `batch_size` at a time and folded into a
+    `SeasonSummary`, so memory does not grow with `iterations`. For a given
+    (seed, workers) pair the seasons are the same as `predict_season`'s.
+
+    :batch_size: Number of iterations simulated at once by each worker.
+    :dump: Optional path of a .npy file to write every simulated season to,
+           as a structured array with the fields and types of `DUMP_TYPES`,
+           each holding one value per team. Read it back with
+           `numpy.load(dump, mmap_mode="r")`.
+    :antithetic: Pair seasons within each batch (see `_uniforms`).
+    :draws: Optional block of uniforms from `common_draws` to use instead of
+            fresh ones. `iterations` and `seed` are then ignored.
+    :returns: A `SeasonSummary`.
+
+    """
+    names, start_elo, _, home, away = _prepare(match_df, teams, regress,
+                                               kwargs.get("R", 3))
 
+    if draws is not None:
+        _check_draws(draws, home, bracket)
+        iterations = len(draws)
 
-def evaluate_playoffs(train_csv, test_csv):
+    seeds = _streams(seed, workers)
+    # The same split as `np.array_split`, without building the index array.
+    sizes = [iterations // workers + (k < iterations % workers) for k in range(workers)]
+    offsets = np.cumsum([0] + sizes[:-1]).tolist()
+
+    if dump is not None:
+        dtype = [(field, kind, (len(names),)) for field, kind in DUMP_TYPES.items()]
+        np.lib.format.open_memmap(dump, mode="w+", dtype=dtype, shape=(iterations,)).flush()
+
+    args = [(names, start_elo, home, away, size, child, bracket, batch_size, dump,
+             offset, kwargs, antithetic,
+             None if draws is None else draws[offset:offset + size])
+            for size, child, offset in zip(sizes, seeds, offsets)]
+
+    if workers == 1:
+        parts = [_summarize_chunk(*args[0])]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(_summarize_chunk, *zip(*args)))
+
+    summary = parts[0]
+    for part in parts[1:]:
+        summary.merge(part)
+
+    return summary
+
+
+def converge_season(match_df, teams, tolerance=0.005, max_iterations=1000000,
+                    time_budget=None, regress=True, seed=None, bracket=TOP_FOUR,
+                    batch_size=5000, min_iterations=5000,
+                    fields=("first_round", "champs"), antithetic=False, **kwargs):
+    """
+    Simulate a season in batches until the odds are precise enough.
+
+    After each batch, the standard error (see `SeasonSummary.stderr`) of
+    every team's `fields` is checked against `tolerance`. The seasons played
+    are the first ones `summarize_season` would play with the same seed and
+    one worker.
+
+    :tolerance: Largest acceptable standard error of any team's probability.
+    :max_iterations: Stop after this many iterations regardless.
+    :time_budget: Optional number of seconds after which to stop regardless.
+    :min_iterations: Don't stop before this many iterations, so that rare
+                     outcomes that haven't happened yet don't look certain.
+    :fields: Statistics whose standard errors must meet `tolerance`.
+    :antithetic: Pair seasons within each batch (see `_uniforms`). The
+                 standard errors still treat seasons as independent, which
+                 overstates them, so this can only stop later than needed,
+                 never sooner.
+    :returns: A `SeasonSummary` with `converged` set. Its `stderr` gives the
+              achieved error bars.
+
+    """
+    names, start_elo, _, home, away = _prepare(match_df, teams, regress,
+                                               kwargs.get("R", 3))
+
+    rng = np.random.default_rng(_streams(seed, 1)[0])
+    summary = SeasonSummary(names, len(home))
+    summary.converged = False
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+
+    while summary.iterations < max_iterations:
+        size = min(batch_size, max_iterations - summary.iterations)
+        draws = _uniforms(rng, size, len(home) + bracket.n_games, antithetic)
+        summary.update(_simulate(start_elo, home, away, draws, bracket, **kwargs))
+
+        if (summary.iterations >= min_iterations and
+                (summary.stderr()[list(fields)].to_numpy() <= tolerance).all()):
+            summary.converged = True
+            break
+
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+
+    return summary
+
+
+def playoff_brier(test_df, team_names, res):
+    """
+    Score the playoff predictions in `res` against the postseason matches of
+    `test_df`.
+
+    :test_df: Match dataframe containing the actual postseason.
+    :team_names: Names of the simulated teams.
+    :res: Result dataframe from `predict_season`, or a `SeasonSummary`.
+    :returns: Total Brier score of the "made the playoffs" predictions.
+
+    """
+    if isinstance(res, SeasonSummary):
+        playoff_predictions = res.mean()["first_round"]
+    else:
+        playoff_predictions = res.xs("first_round", level=1, axis=1).mean()
+    playoff_df = test_df[test_df.postseason == True]
+    playoff_teams = set(playoff_df.home) | set(playoff_df.away)
+
+    made_playoffs = np.array([team in playoff_teams for team in team_names])
+    return elo.brier(made_playoffs, playoff_predictions[team_names].to_numpy()).sum()
+
+
+def evaluate_playoffs(train_csv, test_csv, cache=None, tolerance=None, seed=None):
+    """
+    Score playoff forecasts made with a range of K-factors.
+
+    Every K-factor is simulated with the same antithetic draws (see
+    `common_draws`), so differences between the scores come from K rather
+    than from luck.
+
+    :cache: Optional `cache.ReplayCache` for the history replays, so that
+            reruns with the same data skip them.
+    :tolerance: If given, simulate each forecast until its playoff odds have
+                this standard error (see `converge_season`) instead of for a
+                fixed 5000 iterations.
+    :seed: Seed of the shared draws.
+
+    """
     teams, df = vello.load_games(train_csv)
-    vello.record_games(df, teams)
-    used_teams, test_df = vello.load_games(TEST_INPUT)
+    used_teams, test_df = vello.load_games(test_csv)
 
     Ks = []
     scores = []
 
+    # Resolve the seed once, so every K-factor gets the same stream.
+    entropy = np.random.SeedSequence(seed).entropy
+    draws = common_draws(test_df, 5000, entropy, antithetic=True)
+
     for K in range(10, 110, 10):
         print(K)
         Ks.append(K)
-        teams, df = vello.load_games(train_csv)
-        vello.record_games(df, teams, K=K)
-        used_teams, test_df = vello.load_games(test_csv)
-        team_names, res = predict_season(test_df, teams, 5000, K=K)
-
-        playoff_predictions = res.xs("first_round", level=1, axis=1).mean()
-        playoff_df = test_df[test_df.postseason == True]
-        playoff_teams = set(playoff_df.home) | set(playoff_df.away)
-        print(playoff_teams)
-        score = 0
-        for team in team_names:
-            score += elo.brier(team in playoff_teams, playoff_predictions[team])
-
-        scores.append(score)
+        vello.record_games(df, teams, K=K, reset=True, cache=cache)
+        if tolerance is None:
+            summary = summarize_season(test_df, teams, draws=draws, K=K)
+        else:
+            summary = converge_season(test_df, teams, tolerance, seed=entropy,
+                                      antithetic=True, K=K, fields=["first_round"])
+        scores.append(playoff_brier(test_df, summary.names, summary))
 
     return Ks, scores
 
@@ -174,6 +681,9 @@ if __name__ == "__main__":
 
     print(res.describe())
 
+    # Only load matplotlib once a plot is actually requested.
+    import matplotlib.pyplot as plt
+
     plt.style.use("seaborn")
     fig, axes = plt.subplots(3, 3)
 
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+Conditional "what-if" forecasts from a single set of simulated seasons.
+
+A `Scenario` simulates the season once and keeps the result of every
+scheduled match in every iteration. Questions like "how likely is Berry to
+win the title if Berry beats Centre on 2021-03-27?" are then answered by
+filtering the stored iterations instead of simulating again.
+"""
+
+import numpy as np
+import pandas as pd
+import predict
+import vello
+
+
+class Scenario:
+    def __init__(self, match_df, teams, iterations=10000, **kwargs):
+        """
+        Simulate the season described by `match_df`.
+
+        The remaining arguments are passed on to `predict.simulate`.
+        """
+        self.names, self.schedule, self.results = predict.simulate(
+            match_df, teams, iterations, outcomes=True, **kwargs)
+
+        self.columns = {name: k for k, name in enumerate(self.names)}
+        self.outcomes = self.results["outcomes"]
+        self.iterations = len(self.outcomes)
+
+    def matches(self, home, away, date=None):
+        """
+        Return the positions in the schedule of the matches between `home`
+        and `away` (at either venue), optionally only on `date`.
+        """
+        schedule = self.schedule
+        mask = (((schedule.home == home) & (schedule.away == away)) |
+                ((schedule.home == away) & (schedule.away == home)))
+        if date is not None:
+            mask &= schedule.date == pd.Timestamp(date)
+
+        return np.flatnonzero(mask.to_numpy())
+
+    def mask(self, given=()):
+        """
+        Return a boolean mask of the iterations consistent with `given`.
+
+        :given: Iterable of (winner, loser) or (winner, loser, date) tuples.
+                Every scheduled match between the two teams (on that date, if
+                given) must be won by `winner`.
+
+        """
+        mask = np.ones(self.iterations, dtype=bool)
+
+        for condition in given:
+            winner, loser = condition[:2]
+            date = condition[2] if len(condition) > 2 else None
+            positions = self.matches(winner, loser, date)
+            if len(positions) == 0:
+                raise ValueError("No scheduled match between {} and {}{}."
+                                 .format(winner, loser,
+                                         " on {}".format(date) if date else ""))
+
+            home_is_winner = (self.schedule.home.to_numpy()[positions] == winner)
+            mask &= (self.outcomes[:, positions] == home_is_winner).all(axis=1)
+
+        return mask
+
+    def prob(self, team, outcome="champs", given=()):
+        """
+        Return P(`outcome` | `given`) for `team`, and the number of iterations
+        it is based on.
+
+        :outcome: A boolean statistic: "first_round", "second_round" or
+                  "champs".
+
+        """
+        mask = self.mask(given)
+        n = int(mask.sum())
+        if n == 0:
+            return np.nan, 0
+
+        return self.results[outcome][mask, self.columns[team]].mean(), n
+
+    def leverage(self, outcome="champs", teams=None):
+        """
+        Return how much every scheduled match swings each team's odds.
+
+        :outcome: A boolean statistic, as for `prob`.
+        :teams: Teams to report on. Defaults to every team.
+        :returns: Dataframe with one row per scheduled match and, for each
+                  team, the probability of `outcome` given a home win, given
+                  an away win, and their difference ("leverage").
+
+        """
+        teams = self.names if teams is None else list(teams)
+        columns = [self.columns[team] for team in teams]
+
+        home_won = self.outcomes.astype(float)
+        achieved = self.results[outcome][:, columns].astype(float)
+
+        # One matrix product per side conditions on every match at once.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            given_home = (home_won.T @ achieved) / home_won.sum(axis=0)[:, None]
+            given_away = ((1 - home_won).T @ achieved) / (1 - home_won).sum(axis=0)[:, None]
+
+        index = pd.MultiIndex.from_frame(self.schedule[["date", "home", "away"]])
+        frames = {"given_home": given_home, "given_away": given_away,
+                  "leverage": given_home - given_away}
+        table = pd.concat({key: pd.DataFrame(values, index=index, columns=teams)
+                           for key, values in frames.items()}, axis=1)
+
+        return table.swaplevel(axis=1).sort_index(axis=1, level=0, sort_remaining=False)
+
+
+if __name__ == "__main__":
+    teams, df = vello.load_games("./data/games.csv")
+    vello.record_games(df, teams)
+    _, test_df = vello.load_games("./data/test.csv")
+
+    scenario = Scenario(test_df, teams, 20000, seed=0)
+
+    print("P(Berry champs):", scenario.prob("Berry"))
+    print("P(Berry champs | Berry beats Centre on 2021-03-27):",
+          scenario.prob("Berry", given=[("Berry", "Centre", "2021-03-27")]))
+
+    print(scenario.leverage(teams=["Berry"]).sort_values(("Berry", "leverage")))
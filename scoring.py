@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""
+Score many prediction columns over many seasons at once.
+
+Everything here works on a (matches, predictors) matrix, so adding more
+predictors costs one more column rather than one more pass over the data.
+"""
+
+import numpy as np
+import pandas as pd
+import vello
+
+
+def _matrix(df, result_col, predict_cols):
+    results = df[result_col].to_numpy(float)[:, None]
+    predictions = df[list(predict_cols)].to_numpy(float)
+    return results, predictions
+
+
+def brier_scores(df, result_col, predict_cols):
+    """
+    Return the modified Brier score (see `elo.brier_score`) of every match for
+    every prediction column, as a dataframe with one column per predictor.
+    """
+    results, predictions = _matrix(df, result_col, predict_cols)
+    scores = 100 * (1 - (results - predictions)**2) - 75
+    return pd.DataFrame(scores, index=df.index, columns=list(predict_cols))
+
+
+def log_losses(df, result_col, predict_cols, eps=1e-15):
+    """
+    Return the log-loss of every match for every prediction column.
+
+    Predictions are clipped to [eps, 1 - eps] so that confident misses stay
+    finite.
+    """
+    results, predictions = _matrix(df, result_col, predict_cols)
+    predictions = np.clip(predictions, eps, 1 - eps)
+    losses = -(results * np.log(predictions) + (1 - results) * np.log(1 - predictions))
+    return pd.DataFrame(losses, index=df.index, columns=list(predict_cols))
+
+
+def calibration(df, result_col, predict_cols, buckets=10):
+    """
+    Bucket the predictions and compare them with the observed outcomes.
+
+    :buckets: Number of equal-width probability buckets in [0, 1].
+    :returns: Dataframe indexed by (predictor, bucket) with the mean
+              prediction, the observed frequency and the number of matches in
+              each non-empty bucket.
+
+    """
+    results, predictions = _matrix(df, result_col, predict_cols)
+    n = len(predict_cols)
+
+    bucket = np.minimum((predictions * buckets).astype(int), buckets - 1)
+    # Give every (predictor, bucket) pair its own bin.
+    bins = (bucket + buckets * np.arange(n)).ravel()
+
+    count = np.bincount(bins, minlength=n * buckets)
+    predicted = np.bincount(bins, weights=predictions.ravel(), minlength=n * buckets)
+    observed = np.bincount(bins, weights=np.broadcast_to(results, predictions.shape).ravel(),
+                           minlength=n * buckets)
+
+    index = pd.MultiIndex.from_product([list(predict_cols), range(buckets)],
+                                       names=["predictor", "bucket"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        table = pd.DataFrame({"predicted": predicted / count,
+                              "observed": observed / count,
+                              "count": count}, index=index)
+
+    return table[table["count"] > 0]
+
+
+def evaluate(df, result_col, predict_cols, season=None, window=7, buckets=10):
+    """
+    Score any number of prediction columns across seasons in one pass.
+
+    :df: Match dataframe with results and predictions.
+    :result_col: Column of 0/1 results, like "home_won".
+    :predict_cols: Columns of home win probabilities.
+    :season: Column name or series of season labels. Defaults to
+             `vello.season_years`.
+    :window: Window of the rolling mean of the cumulative Brier score, as in
+             `plots.plot_brier`.
+    :buckets: Number of calibration buckets.
+    :returns: Dictionary of dataframes:
+
+        "brier": per-match Brier scores.
+        "totals": total Brier score per season (rows) and predictor (columns).
+        "cumulative": running Brier total within each season.
+        "rolling": rolling mean of "cumulative" within each season.
+        "log_loss": mean log-loss per season and predictor.
+        "calibration": see `calibration`.
+
+    """
+    predict_cols = list(predict_cols)
+
+    if season is None:
+        season = vello.season_years(df)
+    elif isinstance(season, str):
+        season = df[season]
+
+    brier = brier_scores(df, result_col, predict_cols)
+    groups = brier.groupby(season.to_numpy())
+    cumulative = groups.cumsum()
+
+    rolling = (cumulative.groupby(season.to_numpy())
+                         .rolling(window).mean()
+                         .reset_index(level=0, drop=True)
+                         .loc[brier.index])
+
+    log_loss = log_losses(df, result_col, predict_cols).groupby(season.to_numpy()).mean()
+
+    return {"brier": brier, "totals": groups.sum(), "cumulative": cumulative,
+            "rolling": rolling, "log_loss": log_loss,
+            "calibration": calibration(df, result_col, predict_cols, buckets)}
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+Serve live Elo ratings over HTTP.
+
+A `RatingService` polls one or more results sources, applies new matches to a
+`state.RatingState` in a background thread, and publishes an immutable
+snapshot of the ratings. Readers only ever see a complete snapshot, so any
+number of them can be served without waiting on ingestion.
+
+Endpoints:
+
+    GET /ratings                        Current Elo of every team.
+    GET /win_prob?home=Berry&away=Centre Home win probability of a matchup.
+    GET /matchups?home=A,B&away=C,D      Win probabilities, set scores and
+                                         Elo swings of A v C and B v D.
+    GET /matrix[?teams=A,B,C]            Win probabilities of every pairing.
+"""
+
+from urllib.parse import urlsplit, parse_qs
+from urllib.request import urlopen
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import logging
+import pandas as pd
+import matchups
+import state
+
+log = logging.getLogger(__name__)
+
+
+class FileSource:
+    def __init__(self, csv):
+        """
+        Read new matches appended to a local CSV file.
+
+        Useful as a stand-in for a real feed: append rows to the file and the
+        service picks them up on its next poll.
+        """
+        self.csv = csv
+        self.seen = 0
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.csv)
+
+    def _read(self):
+        return pd.read_csv(self.csv)
+
+    async def poll(self):
+        """
+        Return a dataframe of the matches added since the last commit, and
+        the cursor to pass to `commit` once they have been applied.
+        """
+        df = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        return df.iloc[self.seen:], len(df)
+
+    def commit(self, cursor):
+        """Mark the matches returned with `cursor` as applied."""
+        self.seen = cursor
+
+
+class HTTPSource(FileSource):
+    def __init__(self, url, timeout=10):
+        """Read new matches from a CSV served over HTTP."""
+        super().__init__(url)
+        self.timeout = timeout
+
+    def _read(self):
+        with urlopen(self.csv, timeout=self.timeout) as response:
+            return pd.read_csv(io.BytesIO(response.read()))
+
+
+class RatingService:
+    def __init__(self, rating_state, sources, interval=5):
+        """
+        :rating_state: The `state.RatingState` to update.
+        :sources: Results sources. Anything with an async `poll()` method
+                  returning a match dataframe and a cursor, and a
+                  `commit(cursor)` method, will do.
+        :interval: Seconds between polls.
+
+        """
+        self.state = rating_state
+        self.sources = list(sources)
+        self.interval = interval
+        self._publish()
+
+    def _publish(self):
+        ratings = dict(zip(self.state.names, self.state.elos))
+        body = {"ratings": ratings, "matches": len(self.state.days),
+                "updated": datetime.datetime.now().isoformat()}
+
+        # Swapping the reference is atomic, so readers never see a partial
+        # update. The encoded body is cached since most requests want it.
+        self.snapshot = (ratings, json.dumps(body).encode(),
+                         matchups.RatingTable.from_state(self.state))
+
+    async def update(self):
+        """
+        Poll every source once and apply any new matches.
+
+        Rows that can't be applied (see `state.RatingState.check`) are logged
+        and skipped. If polling or applying fails, the error is logged and
+        the source is polled again from the same place next time.
+        """
+        loop = asyncio.get_running_loop()
+
+        for source in self.sources:
+            try:
+                matches, cursor = await source.poll()
+                matches, rejected = self.state.check(matches)
+                for row in rejected.itertuples(index=False):
+                    log.warning("Skipping invalid match from %r: %s", source, tuple(row))
+
+                if not matches.empty:
+                    await loop.run_in_executor(None, self.state.ingest, matches)
+                    self._publish()
+                source.commit(cursor)
+            except Exception:
+                log.exception("Updating from %r failed", source)
+
+    async def run(self):
+        """Poll the sources forever."""
+        while True:
+            await self.update()
+            await asyncio.sleep(self.interval)
+
+    def win_prob(self, home, away):
+        """Return the home win probability of a matchup from the snapshot."""
+        return float(self.snapshot[2].win_prob(home, away))
+
+    def matchups(self, home, away):
+        """Return the JSON-ready `matchups.RatingTable.query` of a slate."""
+        res = self.snapshot[2].query(home, away)
+        scores = ["{}-{}".format(*score) for score in matchups.SCORES]
+
+        return {"home": list(home), "away": list(away),
+                "win_prob": res["win_prob"].tolist(),
+                "set_scores": [dict(zip(scores, row)) for row in res["set_scores"].tolist()],
+                "expected_home_change": res["expected_home_change"].tolist(),
+                "expected_swing": res["expected_swing"].tolist()}
+
+    def respond(self, target):
+        """Return (status, body) for a GET of `target`."""
+        url = urlsplit(target)
+
+        if url.path == "/ratings":
+            return 200, self.snapshot[1]
+
+        if url.path == "/win_prob":
+            query = parse_qs(url.query)
+            if "home" not in query or "away" not in query:
+                return 400, b'{"error": "home and away are required"}'
+
+            home, away = query["home"][0], query["away"][0]
+            try:
+                prob = self.win_prob(home, away)
+            except KeyError as e:
+                return 404, json.dumps({"error": "unknown {}".format(e)}).encode()
+
+            return 200, json.dumps({"home": home, "away": away,
+                                    "win_prob": prob}).encode()
+
+        if url.path == "/matchups":
+            query = parse_qs(url.query)
+            home = query.get("home", [""])[0].split(",")
+            away = query.get("away", [""])[0].split(",")
+            if len(home) != len(away):
+                return 400, b'{"error": "home and away differ in length"}'
+            try:
+                return 200, json.dumps(self.matchups(home, away)).encode()
+            except KeyError as e:
+                return 404, json.dumps({"error": "unknown {}".format(e)}).encode()
+
+        if url.path == "/matrix":
+            query = parse_qs(url.query)
+            teams = query["teams"][0].split(",") if "teams" in query else None
+            try:
+                matrix = self.snapshot[2].matrix(teams)
+            except KeyError as e:
+                return 404, json.dumps({"error": "unknown {}".format(e)}).encode()
+
+            return 200, json.dumps({"teams": list(matrix.index),
+                                    "win_prob": matrix.to_numpy().tolist()}).encode()
+
+        return 404, json.dumps({"error": "not found"}).encode()
+
+    async def handle(self, reader, writer):
+        """Answer a single HTTP request."""
+        try:
+            request = await reader.readline()
+            # Skip the headers; nothing in them matters here.
+            while (await reader.readline()).strip():
+                pass
+
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                status, body = 405, b'{"error": "method not allowed"}'
+            else:
+                status, body = self.respond(parts[1])
+
+            reason = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                      405: "Method Not Allowed"}[status]
+            writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+                         "Content-Length: {}\r\nConnection: close\r\n\r\n"
+                         .format(status, reason, len(body)).encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        """Poll the sources and serve HTTP requests until cancelled."""
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.run())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve live volleyball Elo ratings.")
+    parser.add_argument("source", help="CSV path or http(s) URL of match results.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--interval", type=float, default=5,
+                        help="Seconds between polls of the source.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.source.startswith(("http://", "https://")):
+        source = HTTPSource(args.source)
+    else:
+        source = FileSource(args.source)
+
+    service = RatingService(state.RatingState(), [source], args.interval)
+    asyncio.run(service.serve(port=args.port))
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+"""
+Persistent, incrementally updated Elo ratings.
+
+A `RatingState` remembers every match it has applied, the current rating,
+record and last game of every team, and periodic checkpoints of all of that.
+New results are applied with `ingest` without replaying the whole history.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+import vello
+from store import MATCH_COLUMNS
+import elo
+
+
+class RatingState:
+    def __init__(self, teams=(), K=40, R=3, home_advantage=0, set_map=None,
+                 postseason_multiplier=1, checkpoint_every=50, elo_name="elo"):
+        """
+        :teams: Initial `elo.Team` objects. Teams that first appear in an
+                ingested match start at 1500.
+        :checkpoint_every: Number of matches between checkpoints. A
+                           checkpoint is taken once at least this many
+                           matches have been applied since the last one,
+                           however they were split across `ingest` calls.
+                           Smaller values make out-of-order inserts cheaper
+                           to reconcile.
+        :elo_name: Name of the Elo columns in returned dataframes.
+        :raises ValueError: If `checkpoint_every` is less than 1.
+
+        The remaining arguments are the same as for `vello.record_games`.
+        """
+        if checkpoint_every < 1:
+            raise ValueError("checkpoint_every must be at least 1, not {}."
+                             .format(checkpoint_every))
+
+        self.params = {"K": K, "R": R, "home_advantage": home_advantage,
+                       "set_map": set_map,
+                       "postseason_multiplier": postseason_multiplier}
+        self.checkpoint_every = checkpoint_every
+        self.elo_name = elo_name
+
+        self.names = []
+        self.index = dict()
+        self.elos = []
+        self.wins = []
+        self.losses = []
+        self.last_seen = []
+
+        for team in teams:
+            self._add_team(team.name, team.elo)
+            self.wins[-1] = team.wins
+            self.losses[-1] = team.losses
+
+        # Every applied match, in the order it was applied.
+        self.matches = {column: [] for column in MATCH_COLUMNS}
+        self.days = []
+        self.home_elo = []
+        self.away_elo = []
+        self.win_prob = []
+
+        # Each checkpoint is (matches applied, snapshot of the team state).
+        self.checkpoints = []
+        self._checkpoint()
+
+    def _add_team(self, name, rating=1500):
+        self.index[name] = len(self.names)
+        self.names.append(name)
+        self.elos.append(rating)
+        self.wins.append(0)
+        self.losses.append(0)
+        self.last_seen.append(None)
+
+    def _checkpoint(self):
+        snapshot = (list(self.elos), list(self.wins), list(self.losses),
+                    list(self.last_seen))
+        self.checkpoints.append((len(self.days), snapshot))
+
+    def _restore(self, position):
+        """Rewind to the checkpoint at `position` in `self.checkpoints`."""
+        del self.checkpoints[position + 1:]
+        applied, (elos, wins, losses, last_seen) = self.checkpoints[position]
+
+        # Teams added after the checkpoint keep their codes but start fresh.
+        extra = len(self.names) - len(elos)
+        self.elos = list(elos) + [1500] * extra
+        self.wins = list(wins) + [0] * extra
+        self.losses = list(losses) + [0] * extra
+        self.last_seen = list(last_seen) + [None] * extra
+
+        removed = {column: values[applied:]
+                   for column, values in self.matches.items()}
+        for values in self.matches.values():
+            del values[applied:]
+        for values in (self.days, self.home_elo, self.away_elo, self.win_prob):
+            del values[applied:]
+
+        return pd.DataFrame(removed, columns=MATCH_COLUMNS)
+
+    def check(self, matches):
+        """
+        Split `matches` into rows that `ingest` can apply and rows it can't.
+
+        A row is rejected if a team is missing or plays itself, the date
+        doesn't parse, or the score isn't a win for exactly one side in a
+        number of sets that `set_map` knows.
+
+        :returns: Tuple of (valid, rejected) dataframes.
+
+        """
+        missing = [column for column in MATCH_COLUMNS if column not in matches]
+        if missing:
+            return matches.iloc[:0], matches
+
+        set_map = self.params["set_map"] or elo.SET_MAP
+        home_score = pd.to_numeric(matches.home_score, errors="coerce")
+        away_score = pd.to_numeric(matches.away_score, errors="coerce")
+        dates = pd.to_datetime(matches.date, errors="coerce")
+
+        valid = (matches.home.notna() & matches.away.notna() &
+                 (matches.home != matches.away) & dates.notna() &
+                 ((home_score == 3) != (away_score == 3)) &
+                 (home_score + away_score).isin(list(set_map)))
+
+        return matches[valid], matches[~valid]
+
+    @property
+    def last_day(self):
+        """Day number of the most recently applied match, or None."""
+        return self.days[-1] if self.days else None
+
+    def ingest(self, matches, reconcile=True):
+        """
+        Apply new matches to the ratings.
+
+        :matches: Match dataframe with (at least) the columns of `MATCH_COLUMNS`.
+        :reconcile: If a match is older than the latest applied match, rewind
+                    to the nearest earlier checkpoint and replay from there.
+                    Otherwise, raise a ValueError.
+        :returns: Match dataframe of every match applied by this call (which
+                  includes replayed matches after a rewind) with Elo columns.
+        :raises ValueError: If any match is invalid (see `check`). Nothing is
+                            applied in that case.
+
+        """
+        _, rejected = self.check(matches)
+        if not rejected.empty:
+            raise ValueError("{} invalid matches, the first being {}."
+                             .format(len(rejected), tuple(rejected.iloc[0])))
+
+        matches = matches[MATCH_COLUMNS].copy()
+        matches["date"] = pd.to_datetime(matches["date"])
+        matches = matches.sort_values("date", kind="stable")
+
+        if matches.empty:
+            return self._frame(len(self.days), len(self.days))
+
+        days = matches.date.to_numpy().astype("datetime64[D]").astype(np.int64)
+        first = int(days[0])
+        if self.last_day is not None and first < self.last_day:
+            if not reconcile:
+                raise ValueError("Match on {} is older than the latest applied match."
+                                 .format(matches.date.iloc[0].date()))
+
+            # The latest checkpoint taken before any match later than `first`.
+            position = max(k for k, (applied, _) in enumerate(self.checkpoints)
+                           if applied == 0 or self.days[applied - 1] <= first)
+            removed = self._restore(position)
+            removed["date"] = pd.to_datetime(removed["date"])
+            matches = pd.concat([removed, matches], ignore_index=True)
+            matches = matches.sort_values("date", kind="stable")
+
+        start = len(self.days)
+        k = 0
+        while k < len(matches):
+            # Apply up to the next checkpoint, then take it if it is due.
+            due = self.checkpoints[-1][0] + self.checkpoint_every - len(self.days)
+            self._apply(matches.iloc[k:k + due])
+            k += due
+
+            if len(self.days) - self.checkpoints[-1][0] >= self.checkpoint_every:
+                self._checkpoint()
+
+        return self._frame(start, len(self.days))
+
+    def _apply(self, matches):
+        for name in pd.concat([matches.home, matches.away]).unique():
+            if name not in self.index:
+                self._add_team(name)
+
+        home, away, days, home_won, sets = vello._match_arrays(matches, self.index)
+        postseason = matches.postseason.astype(bool).tolist()
+
+        params = self.params
+        factors = vello._factors(sets, postseason, params["K"], params["set_map"],
+                                 params["postseason_multiplier"])
+
+        home_elo, away_elo, win_prob = vello._replay(home, away, days, home_won,
+                                                     factors, self.elos,
+                                                     self.last_seen, params["R"],
+                                                     params["home_advantage"])
+
+        for h, a, won in zip(home, away, home_won):
+            winner, loser = (h, a) if won else (a, h)
+            self.wins[winner] += 1
+            self.losses[loser] += 1
+
+        for column in MATCH_COLUMNS:
+            self.matches[column].extend(matches[column].tolist())
+        self.days.extend(days)
+        self.home_elo.extend(home_elo)
+        self.away_elo.extend(away_elo)
+        self.win_prob.extend(win_prob)
+
+    def _frame(self, start, stop):
+        df = pd.DataFrame({column: values[start:stop]
+                           for column, values in self.matches.items()},
+                          columns=MATCH_COLUMNS)
+        df["date"] = pd.to_datetime(df["date"])
+        df["home_won"] = df["home_score"] == 3
+        df["home_{}".format(self.elo_name)] = self.home_elo[start:stop]
+        df["away_{}".format(self.elo_name)] = self.away_elo[start:stop]
+        df["{}_win_prob".format(self.elo_name)] = self.win_prob[start:stop]
+
+        return df
+
+    def frame(self):
+        """Return every applied match with its Elo columns."""
+        return self._frame(0, len(self.days))
+
+    def teams(self):
+        """Return the current ratings and records as `elo.Team` objects."""
+        teams = []
+        for k, name in enumerate(self.names):
+            team = elo.Team(name, self.elos[k])
+            team.wins = self.wins[k]
+            team.losses = self.losses[k]
+            teams.append(team)
+
+        return teams
+
+    def save(self, path):
+        """Write the state, its checkpoints and its match log to a JSON file."""
+        matches = dict(self.matches)
+        matches["date"] = [str(pd.Timestamp(date).date()) for date in matches["date"]]
+        params = dict(self.params)
+        if params["set_map"] is not None:
+            params["set_map"] = {str(k): v for k, v in params["set_map"].items()}
+
+        data = {"params": params, "checkpoint_every": self.checkpoint_every,
+                "elo_name": self.elo_name, "names": self.names,
+                "elos": self.elos, "wins": self.wins, "losses": self.losses,
+                "last_seen": self.last_seen, "matches": matches,
+                "days": self.days, "home_elo": self.home_elo,
+                "away_elo": self.away_elo, "win_prob": self.win_prob,
+                "checkpoints": self.checkpoints}
+
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path):
+        """Read a state written by `save`."""
+        with open(path) as f:
+            data = json.load(f)
+
+        params = data["params"]
+        if params["set_map"] is not None:
+            params["set_map"] = {int(k): v for k, v in params["set_map"].items()}
+
+        state = cls(checkpoint_every=data["checkpoint_every"],
+                    elo_name=data["elo_name"], **params)
+
+        state.names = data["names"]
+        state.index = {name: k for k, name in enumerate(state.names)}
+        for key in ["elos", "wins", "losses", "last_seen", "matches", "days",
+                    "home_elo", "away_elo", "win_prob"]:
+            setattr(state, key, data[key])
+        state.matches["date"] = list(pd.to_datetime(state.matches["date"]))
+        state.checkpoints = [(applied, tuple(snapshot))
+                             for applied, snapshot in data["checkpoints"]]
+
+        return state
+
+
+if __name__ == "__main__":
+    teams, df = vello.load_games("./data/games.csv")
+    state = RatingState()
+
+    # Feed the history in a few batches, as if the results came in live.
+    for k in range(0, len(df), 50):
+        state.ingest(df.iloc[k:k + 50])
+
+    print(sorted(state.teams(), key=lambda team: team.elo, reverse=True))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+Columnar on-disk cache of match history and computed Elo ratings.
+
+A store is a directory of `.npy` arrays, one per column, that are opened
+memory-mapped. Team names are dictionary-encoded as integer codes and dates
+are stored as day numbers, so reopening a store parses nothing.
+
+    games.store/
+        meta.json           Team names and the source file's size and mtime.
+        home.npy, away.npy  Team codes.
+        home_score.npy, away_score.npy, postseason.npy, date.npy
+        elo/<elo_name>/     Optional sidecar of Elo columns for a parameter set.
+            home.npy, away.npy, win_prob.npy, params.json
+"""
+
+import json
+import os
+import os.path as path
+import shutil
+import numpy as np
+import pandas as pd
+import elo
+
+# The columns that describe a match, shared by vello, the cache and the state.
+MATCH_COLUMNS = ["home", "away", "home_score", "away_score", "postseason", "date"]
+
+
+def _source_stamp(csv):
+    stat = os.stat(csv)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_store(match_df, store_path, source=None):
+    """
+    Write a match dataframe to a store directory.
+
+    :match_df: Match dataframe, e.g. from `vello.load_games`.
+    :store_path: Directory to write. Created if needed.
+    :source: Optional path of the CSV the matches came from, used to detect a
+             stale store.
+    :returns: The opened `MatchStore`.
+
+    """
+    os.makedirs(store_path, exist_ok=True)
+
+    # Ratings computed for older matches are no longer valid.
+    shutil.rmtree(path.join(store_path, "elo"), ignore_errors=True)
+
+    names = sorted(set(match_df.home) | set(match_df.away))
+    codes = {name: k for k, name in enumerate(names)}
+
+    arrays = {
+        "home": match_df.home.map(codes).to_numpy(np.int32),
+        "away": match_df.away.map(codes).to_numpy(np.int32),
+        "home_score": match_df.home_score.to_numpy(np.int8),
+        "away_score": match_df.away_score.to_numpy(np.int8),
+        "postseason": match_df.postseason.to_numpy(bool),
+        "date": pd.to_datetime(match_df.date).to_numpy()
+                  .astype("datetime64[D]").astype(np.int32),
+    }
+
+    for name, values in arrays.items():
+        np.save(path.join(store_path, name + ".npy"), values)
+
+    meta = {"teams": names, "matches": len(match_df),
+            "source": _source_stamp(source) if source else None}
+    with open(path.join(store_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    return MatchStore(store_path)
+
+
+class MatchStore:
+    def __init__(self, store_path):
+        """Open an existing store. The columns are memory-mapped, not read."""
+        self.path = store_path
+
+        with open(path.join(store_path, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        self.teams = self.meta["teams"]
+        self.columns = {name: np.load(path.join(store_path, name + ".npy"),
+                                      mmap_mode="r")
+                        for name in MATCH_COLUMNS}
+
+    def __len__(self):
+        return self.meta["matches"]
+
+    def is_fresh(self, csv):
+        """Return True if the store was built from `csv` as it is now."""
+        return self.meta["source"] == _source_stamp(csv)
+
+    def frame(self, elo_names=()):
+        """
+        Materialize a match dataframe, as returned by `vello.load_games`.
+
+        :elo_names: Names of stored rating sidecars whose Elo columns should be
+                    included, as `vello.record_games` would name them.
+
+        """
+        columns = self.columns
+        names = np.array(self.teams, dtype=object)
+
+        data = {
+            "home": names[columns["home"]],
+            "away": names[columns["away"]],
+            "home_score": np.asarray(columns["home_score"], dtype=np.int64),
+            "away_score": np.asarray(columns["away_score"], dtype=np.int64),
+            "postseason": np.asarray(columns["postseason"]),
+            "date": np.asarray(columns["date"]).astype("datetime64[D]"),
+            "home_won": np.asarray(columns["home_score"]) == 3,
+        }
+
+        for elo_name in elo_names:
+            home_elo, away_elo, win_prob = self.ratings(elo_name)
+            data["home_{}".format(elo_name)] = home_elo
+            data["away_{}".format(elo_name)] = away_elo
+            data["{}_win_prob".format(elo_name)] = win_prob
+
+        df = pd.DataFrame(data)
+        df["home"] = df["home"].astype(str)
+        df["away"] = df["away"].astype(str)
+        df["date"] = pd.to_datetime(df["date"])
+
+        return df
+
+    def load_games(self):
+        """Return `(teams, match_df)` just like `vello.load_games`."""
+        return [elo.Team(name, 1500) for name in self.teams], self.frame()
+
+    def _ratings_path(self, elo_name):
+        return path.join(self.path, "elo", elo_name)
+
+    def has_ratings(self, elo_name, params=None):
+        """
+        Return True if a sidecar exists for `elo_name` (and, if given, was
+        computed with exactly `params`).
+        """
+        params_path = path.join(self._ratings_path(elo_name), "params.json")
+        if not path.exists(params_path):
+            return False
+
+        if params is None:
+            return True
+
+        with open(params_path) as f:
+            return json.load(f) == json.loads(json.dumps(params))
+
+    def write_ratings(self, elo_name, elo_df, params=None):
+        """
+        Store the Elo columns of `elo_df` under `elo_name`.
+
+        :elo_df: Output of `vello.record_games` for the stored matches.
+        :params: JSON-serializable parameters used to compute the ratings.
+
+        """
+        ratings_path = self._ratings_path(elo_name)
+        os.makedirs(ratings_path, exist_ok=True)
+
+        for side in ["home", "away"]:
+            np.save(path.join(ratings_path, side + ".npy"),
+                    elo_df["{}_{}".format(side, elo_name)].to_numpy(float))
+        np.save(path.join(ratings_path, "win_prob.npy"),
+                elo_df["{}_win_prob".format(elo_name)].to_numpy(float))
+
+        with open(path.join(ratings_path, "params.json"), "w") as f:
+            json.dump(params or {}, f)
+
+    def ratings(self, elo_name):
+        """Return memory-mapped (home Elo, away Elo, win probability) arrays."""
+        ratings_path = self._ratings_path(elo_name)
+        return tuple(np.load(path.join(ratings_path, name + ".npy"), mmap_mode="r")
+                     for name in ["home", "away", "win_prob"])
+
+
+def open_store(csv, store_path=None):
+    """
+    Open the store for `csv`, (re)building it first if it is missing or stale.
+
+    :store_path: Store directory. Defaults to `csv` with a `.store` suffix.
+
+    """
+    if store_path is None:
+        store_path = path.splitext(csv)[0] + ".store"
+
+    if path.exists(path.join(store_path, "meta.json")):
+        store = MatchStore(store_path)
+        if store.is_fresh(csv):
+            return store
+
+    df = pd.read_csv(csv)
+    df["date"] = pd.to_datetime(df["date"])
+
+    return write_store(df, store_path, source=csv)
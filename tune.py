@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+"""
+Search for good Elo hyperparameters.
+
+Every configuration is scored twice: by the total Brier score of the replayed
+training history, and by the Brier score of the playoff forecast for the test
+season. The match data is loaded once and handed to every worker process.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import product
+import csv
+import numpy as np
+import pandas as pd
+import predict
+import vello
+import elo
+
+PARAMS = ["K", "R", "home_advantage", "postseason_multiplier", "set_map"]
+
+# Keyword arguments of `predict.predict_season` that come from a configuration.
+FORECAST_PARAMS = ["K", "R", "home_advantage", "set_map"]
+
+# Data shared by the worker processes. Set once per process by `_init`.
+_DATA = {}
+
+
+def grid(**space):
+    """
+    Yield every combination of the given parameter values.
+
+    >>> list(grid(K=[20, 40], R=[3]))
+    [{'K': 20, 'R': 3}, {'K': 40, 'R': 3}]
+
+    """
+    names = list(space)
+    for values in product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def random_search(n, seed=None, **space):
+    """
+    Yield `n` random configurations.
+
+    Each parameter is either a list of choices, or a (low, high) tuple to draw
+    uniformly from.
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        config = dict()
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                config[name] = float(rng.uniform(*values))
+            else:
+                config[name] = values[rng.integers(len(values))]
+        yield config
+
+
+def _init(train_df, test_df):
+    _DATA["train"] = train_df
+    _DATA["test"] = test_df
+
+
+def _replay(config):
+    """Replay the training history and return its Brier score and final Elos."""
+    train_df = _DATA["train"]
+    names = sorted(set(train_df.home) | set(train_df.away))
+    teams = [elo.Team(name, 1500) for name in names]
+
+    replay = {key: config[key] for key in PARAMS if key in config}
+    df = vello.record_games(train_df, teams, **replay)
+    score = elo.brier_score(df, "home_won", "elo_win_prob").sum()
+
+    return score, {team.name: team.elo for team in teams}
+
+
+def _forecast(config, elos, iterations, seed):
+    """Forecast the test season from the given Elos and score the playoffs."""
+    test_df = _DATA["test"]
+    teams = [elo.Team(name, rating) for name, rating in elos.items()]
+
+    kwargs = {key: config[key] for key in FORECAST_PARAMS if key in config}
+    summary = predict.summarize_season(test_df, teams, iterations, seed=seed, **kwargs)
+
+    return predict.playoff_brier(test_df, summary.names, summary)
+
+
+def search(train_csv, test_csv, configs, workers=None, iterations=1000,
+           seed=0, prune=None):
+    """
+    Score configurations in parallel, yielding results as they finish.
+
+    :configs: Iterable of configuration dictionaries (see `grid` and
+              `random_search`).
+    :workers: Number of worker processes (defaults to the number of CPUs).
+    :iterations: Simulated seasons per playoff forecast.
+    :seed: Seed for the forecasts. Every configuration uses the same seed.
+    :prune: If given, skip the playoff forecast of any configuration whose
+            history Brier score is more than `prune` points below the best
+            of all configurations. Every replay then finishes before any
+            forecast starts; replays are cheap next to forecasts.
+    :yields: Dictionaries of the configuration and its scores. Pruned
+             configurations have a `playoff_brier` of NaN.
+
+    """
+    teams, train_df = vello.load_games(train_csv)
+    teams, test_df = vello.load_games(test_csv)
+
+    with ProcessPoolExecutor(workers, initializer=_init,
+                             initargs=(train_df, test_df)) as pool:
+        pending = {pool.submit(_replay, config): (config, None) for config in configs}
+
+        if prune is not None:
+            # Prune against the best history score of every configuration, so
+            # that what is pruned doesn't depend on which replays finish first.
+            replays = [(config,) + future.result()
+                       for future, (config, _) in pending.items()]
+            best = max((history for _, history, _ in replays), default=-np.inf)
+
+            pending = dict()
+            pruned = []
+            for config, history, elos in replays:
+                if history >= best - prune:
+                    future = pool.submit(_forecast, config, elos, iterations, seed)
+                    pending[future] = (config, history)
+                else:
+                    pruned.append(dict(config, history_brier=history,
+                                       playoff_brier=np.nan))
+
+            yield from pruned
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                config, history = pending.pop(future)
+
+                if history is None:
+                    history, elos = future.result()
+                    future = pool.submit(_forecast, config, elos, iterations, seed)
+                    pending[future] = (config, history)
+                    continue
+
+                yield dict(config, history_brier=history,
+                           playoff_brier=future.result())
+
+
+def tune(train_csv, test_csv, configs, out=None, **kwargs):
+    """
+    Run `search` and collect the results into a dataframe.
+
+    :out: Optional CSV path. Rows are written as soon as they finish, so a
+          long sweep can be watched (or salvaged) while it runs.
+    :returns: Dataframe with one row per configuration.
+
+    """
+    rows = []
+    writer = None
+    handle = open(out, "w", newline="") if out else None
+
+    try:
+        for row in search(train_csv, test_csv, configs, **kwargs):
+            rows.append(row)
+            if handle:
+                if writer is None:
+                    writer = csv.DictWriter(handle, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+                handle.flush()
+    finally:
+        if handle:
+            handle.close()
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    configs = grid(K=range(10, 110, 10), R=[2, 3, 4], home_advantage=[0, 25, 50])
+    res = tune(predict.TRAIN_INPUT, predict.TEST_INPUT, configs, prune=50)
+
+    print(res.sort_values("playoff_brier", ascending=False).head(10))
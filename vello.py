@@ -4,91 +4,623 @@
 Track Elo of a volleyball team.
 """
 
+from collections import namedtuple
+from itertools import islice
 import os.path as path
 import pandas as pd
+import numpy as np
+import metrics
+import store
+from store import MATCH_COLUMNS
 import elo
 
+GAMES_CSV = path.join(path.dirname(path.abspath(__file__)), "data", "games.csv")
 
-def team_elo_df(match_df, elo_name="elo"):
-    teams = dict()
 
-    for k, row in match_df.iterrows():
-        if row.home not in teams:
-            teams[row.home] = dict()
+def season_years(match_df):
+    """
+    Return the season of every match, as the year that the season started.
+
+    Seasons start in the fall, so matches before July belong to the previous
+    year's season. (The 2020 season was played in the spring of 2021.)
+    """
+    dates = match_df.date
+    return (dates.dt.year - (dates.dt.month < 7)).rename("season")
+
+
+def _long_elo(match_df, elo_names):
+    """
+    Melt the home and away Elo columns into one (date, team, elo) row per
+    team per match, for every Elo name, in match order.
+    """
+    n = len(match_df)
+    frames = []
+
+    for elo_name in elo_names:
+        frames.append(pd.DataFrame({
+            "elo_name": elo_name,
+            "date": np.concatenate([match_df.date.to_numpy()] * 2),
+            "team": np.concatenate([match_df.home.to_numpy(object),
+                                    match_df.away.to_numpy(object)]),
+            "elo": np.concatenate([match_df["home_{}".format(elo_name)].to_numpy(float),
+                                   match_df["away_{}".format(elo_name)].to_numpy(float)]),
+            # Home before away within a match, like the old row-by-row loop.
+            "order": np.concatenate([2 * np.arange(n), 2 * np.arange(n) + 1]),
+        }))
+
+    long = pd.concat(frames, ignore_index=True)
+    long = long.sort_values("order", kind="stable")
 
-        if row.away not in teams:
-            teams[row.away] = dict()
+    # If a team plays more than once on a day, its last rating of the day wins.
+    return long.drop_duplicates(["elo_name", "date", "team"], keep="last")
 
-        teams[row.home][row.date] = row["home_{}".format(elo_name)]
-        teams[row.away][row.date] = row["away_{}".format(elo_name)]
+
+def team_elo_df(match_df, elo_name="elo"):
+    long = _long_elo(match_df, [elo_name])
+    df = long.pivot(index="date", columns="team", values="elo")
+    df.index.name = None
+    df.columns.name = None
 
     # Not every team plays on every day, so interpolate the gaps linearly.
-    df = pd.DataFrame(teams).sort_index().interpolate(method="linear")
+    df = df.sort_index().interpolate(method="linear")
 
     # Sort the columns alphabetically so that legends are always consistent.
     return df.sort_index(axis=1)
 
 
-def load_games(csv):
-    df = pd.read_csv(csv)
-    df["date"] = pd.to_datetime(df["date"])
-    df["home_won"] = df["home_score"] == 3
+def team_elo_panel(match_df, elo_names=("elo",)):
+    """
+    Build the `team_elo_df` frames of every season and Elo name at once.
+
+    :match_df: Match dataframe spanning any number of seasons.
+    :elo_names: Names of the Elo columns to include.
+    :returns: Dataframe indexed by (season, date) with (elo_name, team)
+              columns. Gaps are interpolated within each season only.
+
+    `panel.loc[season][elo_name].dropna(axis=1, how="all")` is the same as
+    `team_elo_df` for that season's matches.
+    """
+    long = _long_elo(match_df, elo_names)
+    long["season"] = season_years(long)
+
+    df = long.pivot(index=["season", "date"], columns=["elo_name", "team"],
+                    values="elo")
+    df = df.sort_index().sort_index(axis=1)
+    df.columns.names = [None, None]
 
-    team_names = set(df.home) | set(df.away)
-    teams = [elo.Team(name, 1500) for name in team_names]
+    # Not every team plays on every day, so interpolate the gaps linearly.
+    return df.groupby(level="season").transform(
+        lambda season: season.interpolate(method="linear"))
+
+
+def load_games(csv, cache=False):
+    """
+    Load a CSV of matches.
+
+    :cache: If True, read the matches from the columnar store next to `csv`
+            (see `store.open_store`), building it on first use.
+    :returns: A list of teams at 1500 Elo and the match dataframe.
+
+    """
+    with metrics.timer("load_games") as timer:
+        if cache:
+            teams, df = store.open_store(csv).load_games()
+        else:
+            df = pd.read_csv(csv)
+            df["date"] = pd.to_datetime(df["date"])
+            df["home_won"] = df["home_score"] == 3
+
+            team_names = set(df.home) | set(df.away)
+            teams = [elo.Team(name, 1500) for name in sorted(team_names)]
+
+        timer.items = len(df)
 
     return teams, df
 
 
-def record_games(match_df, teams, K=40, R=3, elo_name="elo", reset=False):
+def _match_arrays(match_df, index):
+    """
+    Convert a match dataframe into plain sequences for `_replay`.
+
+    :match_df: A match dataframe.
+    :index: Dictionary mapping team names to integer codes.
+    :returns: Tuple of (home codes, away codes, day numbers, home won flags,
+              set counts) as lists.
+
+    """
+    home = match_df.home.map(index).tolist()
+    away = match_df.away.map(index).tolist()
+    days = match_df.date.to_numpy().astype("datetime64[D]").astype(np.int64).tolist()
+    home_won = (match_df.home_score == 3).tolist()
+    sets = (match_df.home_score + match_df.away_score).tolist()
+
+    return home, away, days, home_won, sets
+
+
+def _postseason(match_df):
+    """
+    Return the postseason flag of each match as a list. Frames without a
+    postseason column are taken to be all regular season matches.
+    """
+    if "postseason" not in match_df:
+        return [False] * len(match_df)
+
+    return match_df.postseason.astype(bool).tolist()
+
+
+def _factors(sets, postseason, K=40, set_map=None, postseason_multiplier=1):
+    """
+    Return the Elo update factor of each match.
+
+    :sets: Number of sets played in each match.
+    :postseason: Postseason flag of each match.
+    :returns: List of K times the set multiplier (and postseason multiplier).
+
+    """
+    if set_map is None:
+        set_map = elo.SET_MAP
+
+    return [K * set_map[n] * (postseason_multiplier if post else 1)
+            for n, post in zip(sets, postseason)]
+
+
+def _replay(home, away, days, home_won, factors, elos, last_seen, R=3,
+            home_advantage=0):
+    """
+    Replay a sequence of matches over integer team codes.
+
+    :home: Home team code for each match.
+    :away: Away team code for each match.
+    :days: Day number of each match.
+    :home_won: Whether the home team won each match.
+    :factors: Elo update factor of each match (K times the set multiplier).
+    :elos: List of current team ratings, indexed by code. Modified in place.
+    :last_seen: List of the day number each team last played, or None.
+                Modified in place.
+    :R: Regression proportion; teams lose an Rth of their distance to 1500 Elo.
+    :home_advantage: Additive Elo constant for home advantage.
+    :returns: Lists of pre-match home Elo, away Elo and home win probability.
+
+    The update is exactly the one performed by `elo.Match.update_teams`,
+    including computing the away team's change after the home team's rating
+    has moved, so the results match a replay through `elo.Match` objects.
+    """
+    n = len(home)
+    home_elo = [0.0] * n
+    away_elo = [0.0] * n
+    win_prob = [0.0] * n
+
+    for k in range(n):
+        h = home[k]
+        a = away[k]
+        day = days[k]
+        h_elo = elos[h]
+        a_elo = elos[a]
+
+        # Regress towards to mean if you haven't played in at least 3 months.
+        if last_seen[h] is not None and day - last_seen[h] >= 30 * 3:
+            h_elo -= (h_elo - 1500) / R
+
+        if last_seen[a] is not None and day - last_seen[a] >= 30 * 3:
+            a_elo -= (a_elo - 1500) / R
+
+        last_seen[h] = day
+        last_seen[a] = day
+
+        home_elo[k] = h_elo
+        away_elo[k] = a_elo
+
+        win_val = 1 if home_won[k] else 0
+        factor = factors[k]
+
+        p = 1 / (1 + 10**(-(h_elo + home_advantage - a_elo) / 400))
+        win_prob[k] = p
+        h_elo += factor * (win_val - p)
+
+        p = 1 / (1 + 10**(-(h_elo + home_advantage - a_elo) / 400))
+        a_elo -= factor * (win_val - p)
+
+        elos[h] = h_elo
+        elos[a] = a_elo
+
+    return home_elo, away_elo, win_prob
+
+
+def _record(match_df, names, elos, K=40, R=3, home_advantage=0, set_map=None,
+            postseason_multiplier=1):
+    """
+    Replay `match_df` from the given ratings.
+
+    :names: Team names.
+    :elos: Starting rating of each team in `names`.
+    :returns: Dictionary of arrays: the pre-match "home_elo", "away_elo" and
+              "win_prob" of each match, and the final "elo" and the "wins" and
+              "losses" gained by each team in `names`.
+
+    """
+    index = {name: k for k, name in enumerate(names)}
+    home, away, days, home_won, sets = _match_arrays(match_df, index)
+
+    postseason = _postseason(match_df)
+    factors = _factors(sets, postseason, K, set_map, postseason_multiplier)
+
+    elos = list(elos)
+    last_seen = [None] * len(elos)
+
+    home_elo, away_elo, win_prob = _replay(home, away, days, home_won,
+                                           factors, elos, last_seen, R,
+                                           home_advantage)
+
+    won = np.array(home_won, dtype=bool)
+    home = np.array(home, dtype=np.int64)
+    away = np.array(away, dtype=np.int64)
+    wins = (np.bincount(home[won], minlength=len(elos)) +
+            np.bincount(away[~won], minlength=len(elos)))
+    losses = (np.bincount(home[~won], minlength=len(elos)) +
+              np.bincount(away[won], minlength=len(elos)))
+
+    return {"home_elo": np.array(home_elo), "away_elo": np.array(away_elo),
+            "win_prob": np.array(win_prob), "elo": np.array(elos),
+            "wins": wins, "losses": losses}
+
+
+def record_games(match_df, teams, K=40, R=3, elo_name="elo", reset=False,
+                 home_advantage=0, set_map=None, postseason_multiplier=1,
+                 cache=None):
     """
     :dfs: A list of match dataframes, taken to be consecutive seasons.
     :K: K-factor for Elo updating.
     :R: Regression proportion; teams lose an Rth of their distance to 1500 Elo.
+    :home_advantage: Additive Elo constant for home advantage.
+    :set_map: Dictionary mapping number of sets (3, 4, 5) to constant Elo
+              multiplier. Defaults to the `elo.Match` map.
+    :postseason_multiplier: Constant factor for postseason Elo changes.
+    :cache: Optional `cache.ReplayCache`. Runs with the same matches, starting
+            ratings and parameters are looked up instead of replayed.
     :returns: Dataframe with Elo columns added. Also modifies `teams`.
 
+    The replay itself runs in `_replay` over integer team codes and day
+    numbers rather than rows and `elo.Match` objects.
     """
     if reset:
         for team in teams:
             team.elo = 1500
 
-    last_seen = dict()
+    # Sorting the names makes cache keys independent of the order of `teams`.
     teams = {team.name: team for team in teams}
+    names = sorted(teams)
+    elos = [teams[name].elo for name in names]
+    params = dict(K=K, R=R, home_advantage=home_advantage, set_map=set_map,
+                  postseason_multiplier=postseason_multiplier)
+
+    result = None
+    if cache is not None:
+        key = cache.key(match_df, names, elos, params)
+        result = cache.get(key)
+
+    if result is None:
+        with metrics.timer("record_games", len(match_df)):
+            result = _record(match_df, names, elos, **params)
+        if cache is not None:
+            cache.put(key, result)
+    else:
+        metrics.count("record_games.cache_hits")
+
+    # Update the ratings and records of the involved teams.
+    for k, name in enumerate(names):
+        team = teams[name]
+        team.elo = float(result["elo"][k])
+        team.wins += int(result["wins"][k])
+        team.losses += int(result["losses"][k])
+
+    update = pd.DataFrame({"home_{}".format(elo_name): result["home_elo"],
+                           "away_{}".format(elo_name): result["away_elo"],
+                           "{}_win_prob".format(elo_name): result["win_prob"]})
 
-    home_elo = []
-    away_elo = []
-    win_prob = []
+    return pd.concat([match_df, update], axis=1)
+
+
+def _record_configs(match_df, teams, params, out=None):
+    """
+    Replay `match_df` once for every parameter dictionary in `params`.
+
+    :out: Optional tuple of three (configs, matches) arrays to write the
+          results into instead of allocating new ones.
+    :returns: (configs, matches) arrays of pre-match home Elo, away Elo and
+              home win probability.
+
+    The ratings of all configurations are held in one (configs, teams) array
+    and every match updates all of them at once.
+    """
+    names = sorted(team.name for team in teams)
+    start = {team.name: team.elo for team in teams}
+    index = {name: k for k, name in enumerate(names)}
+
+    home, away, days, home_won, sets = _match_arrays(match_df, index)
+    postseason = _postseason(match_df)
+
+    factors = np.array([_factors(sets, postseason, p.get("K", 40), p.get("set_map"),
+                                 p.get("postseason_multiplier", 1))
+                        for p in params]).reshape(len(params), len(home))
+    R = np.array([p.get("R", 3) for p in params], dtype=float)
+    home_advantage = np.array([p.get("home_advantage", 0) for p in params],
+                              dtype=float)
+
+    elos = np.tile([float(start[name]) for name in names], (len(params), 1))
+    if out is None:
+        out = tuple(np.empty((len(params), len(home))) for _ in range(3))
+    home_elo, away_elo, win_prob = out
 
-    for match in match_df.itertuples():
-        home = teams[match.home]
-        away = teams[match.away]
+    # Whether a team regresses depends only on the schedule, not the ratings.
+    last_seen = [None] * len(names)
+
+    for k in range(len(home)):
+        h = home[k]
+        a = away[k]
+        day = days[k]
+        h_elo = elos[:, h]
+        a_elo = elos[:, a]
 
         # Regress towards to mean if you haven't played in at least 3 months.
-        if match.home in last_seen:
-            delta = match.date - last_seen[match.home]
-            if delta.days >= 30 * 3:
-                home.elo -= (home.elo - 1500) / R
+        if last_seen[h] is not None and day - last_seen[h] >= 30 * 3:
+            h_elo = h_elo - (h_elo - 1500) / R
 
-        if match.away in last_seen:
-            delta = match.date - last_seen[match.away]
-            if delta.days >= 30 * 3:
-                away.elo -= (away.elo - 1500) / R
+        if last_seen[a] is not None and day - last_seen[a] >= 30 * 3:
+            a_elo = a_elo - (a_elo - 1500) / R
 
-        last_seen[match.home] = match.date
-        last_seen[match.away] = match.date
+        last_seen[h] = day
+        last_seen[a] = day
 
-        home_elo.append(home.elo)
-        away_elo.append(away.elo)
+        home_elo[:, k] = h_elo
+        away_elo[:, k] = a_elo
 
-        match = elo.Match(home, away, match.home_score, match.away_score, K=K)
-        win_prob.append(match.win_prob)
-        match.update_teams()
+        win_val = 1 if home_won[k] else 0
+        factor = factors[:, k]
 
-    update = pd.DataFrame({"home_{}".format(elo_name): home_elo,
-                           "away_{}".format(elo_name): away_elo,
-                           "{}_win_prob".format(elo_name): win_prob})
+        p = 1 / (1 + 10**(-(h_elo + home_advantage - a_elo) / 400))
+        win_prob[:, k] = p
+        h_elo = h_elo + factor * (win_val - p)
 
-    return pd.concat([match_df, update], axis=1)
+        p = 1 / (1 + 10**(-(h_elo + home_advantage - a_elo) / 400))
+        a_elo = a_elo - factor * (win_val - p)
+
+        elos[:, h] = h_elo
+        elos[:, a] = a_elo
+
+    return home_elo, away_elo, win_prob
+
+
+def record_configs(match_df, teams, configs):
+    """
+    Replay `match_df` under several Elo configurations in a single pass.
+
+    :match_df: A match dataframe.
+    :teams: Teams with their starting ratings. Unlike `record_games`, the teams
+            are not modified.
+    :configs: Dictionary (or list of pairs) mapping an Elo name to a
+              dictionary of `record_games` parameters: K, R, home_advantage,
+              set_map and postseason_multiplier.
+    :returns: Dataframe with the home, away and win probability columns of
+              every configuration added.
+
+    """
+    configs = dict(configs)
+    home_elo, away_elo, win_prob = _record_configs(match_df, teams,
+                                                   list(configs.values()))
+
+    update = dict()
+    for c, elo_name in enumerate(configs):
+        update["home_{}".format(elo_name)] = home_elo[c]
+        update["away_{}".format(elo_name)] = away_elo[c]
+        update["{}_win_prob".format(elo_name)] = win_prob[c]
+
+    return pd.concat([match_df, pd.DataFrame(update)], axis=1)
+
+
+class SeasonBatch:
+    def __init__(self, match_df):
+        """
+        Hold many consecutive seasons for rating in a single pass.
+
+        :match_df: Match dataframe of every season, in date order (for
+                   example, from `load_games`). It is not copied.
+
+        Each `record` call writes its Elo columns straight into arrays
+        allocated once for the call, and `season` hands out slices of those
+        arrays rather than copies.
+        Leagues can share a batch as long as their team names differ.
+        """
+        self.df = match_df
+
+        seasons = season_years(match_df).to_numpy()
+        starts = np.flatnonzero(np.r_[True, seasons[1:] != seasons[:-1]])
+        stops = np.r_[starts[1:], len(seasons)]
+
+        if len(set(seasons[starts])) != len(starts):
+            raise ValueError("Matches must be sorted so that each season is contiguous.")
+
+        self.bounds = {int(seasons[start]): (start, stop)
+                       for start, stop in zip(starts, stops)}
+        self.columns = dict()
+
+    @property
+    def seasons(self):
+        return list(self.bounds)
+
+    def _bounds(self, year):
+        if year not in self.bounds:
+            raise ValueError("No matches in the {} season; the batch has {}."
+                             .format(year, ", ".join(map(str, self.seasons))))
+        return self.bounds[year]
+
+    def record(self, configs, teams=None):
+        """
+        Rate every season under one or more configurations.
+
+        :configs: Dictionary mapping an Elo name to `record_games` parameters,
+                  as for `record_configs`.
+        :teams: Teams with their starting ratings. Defaults to every team at
+                1500. The teams are not modified.
+
+        Ratings carry over from one season to the next, with the usual
+        regression toward the mean after three months off.
+        """
+        configs = dict(configs)
+        if teams is None:
+            teams = [elo.Team(name, 1500)
+                     for name in sorted(set(self.df.home) | set(self.df.away))]
+
+        # One (configs, matches) buffer per kind of column, filled in place.
+        out = tuple(np.empty((len(configs), len(self.df))) for _ in range(3))
+        _record_configs(self.df, teams, list(configs.values()), out=out)
+
+        home_elo, away_elo, win_prob = out
+        for c, elo_name in enumerate(configs):
+            self.columns["home_{}".format(elo_name)] = home_elo[c]
+            self.columns["away_{}".format(elo_name)] = away_elo[c]
+            self.columns["{}_win_prob".format(elo_name)] = win_prob[c]
+
+    def season(self, year):
+        """
+        Return a dictionary of one season's Elo columns, as array views.
+
+        :year: Year the season started, as in `season_years`.
+        :raises ValueError: If the batch has no matches in that season.
+
+        """
+        start, stop = self._bounds(year)
+        return {name: values[start:stop] for name, values in self.columns.items()}
+
+    def frame(self, year):
+        """Return one season's matches together with its Elo columns."""
+        start, stop = self._bounds(year)
+        df = self.df.iloc[start:stop].reset_index(drop=True)
+        for name, values in self.season(year).items():
+            df[name] = values
+
+        return df
+
+
+def get_historical_df(year, csv=GAMES_CSV, cache=False):
+    """
+    Return the matches of one season.
+
+    :year: Two-digit year that the season started in (19 is 2019-2020).
+    :csv: Match CSV to read. Defaults to `data/games.csv`.
+    :cache: Read through the columnar store (see `load_games`).
+    :returns: Match dataframe of the season, indexed from 0.
+
+    """
+    _, df = load_games(csv, cache=cache)
+    return df[season_years(df) == 2000 + year].reset_index(drop=True)
+
+
+def record_seasons(dfs, teams=None, elo_name="elo", **kwargs):
+    """
+    Add Elo columns to consecutive seasons, in place.
+
+    :dfs: A list of match dataframes, taken to be consecutive seasons.
+    :teams: Teams to start from and update. Defaults to every team at 1500.
+    :returns: The teams with their final ratings.
+
+    Ratings carry over from one season to the next, and so does the
+    regression toward the mean between seasons. The remaining arguments are
+    the same as for `record_games`.
+    """
+    if teams is None:
+        names = set()
+        for df in dfs:
+            names |= set(df.home) | set(df.away)
+        teams = [elo.Team(name, 1500) for name in sorted(names)]
+
+    all_df = pd.concat(dfs, ignore_index=True)
+    elo_df = record_games(all_df, teams, elo_name=elo_name, **kwargs)
+
+    columns = ["home_{}".format(elo_name), "away_{}".format(elo_name),
+               "{}_win_prob".format(elo_name)]
+    start = 0
+    for df in dfs:
+        for column in columns:
+            df[column] = elo_df[column].to_numpy()[start:start + len(df)]
+        start += len(df)
+
+    return teams
+
+
+# One match's rating update, as yielded by `stream_games`.
+RatingUpdate = namedtuple("RatingUpdate", ["date", "home", "away", "home_elo",
+                                           "away_elo", "win_prob", "brier"])
+
+
+def _chunks(source, chunksize):
+    """
+    Yield match dataframes of at most `chunksize` rows from a CSV path or an
+    iterable of rows (dictionaries, or tuples in `MATCH_COLUMNS` order).
+    """
+    if isinstance(source, str):
+        yield from pd.read_csv(source, chunksize=chunksize)
+        return
+
+    rows = iter(source)
+    while True:
+        chunk = list(islice(rows, chunksize))
+        if not chunk:
+            return
+
+        if isinstance(chunk[0], dict):
+            yield pd.DataFrame(chunk)
+        else:
+            yield pd.DataFrame(chunk, columns=MATCH_COLUMNS)
+
+
+def stream_games(source, teams=(), chunksize=10000, K=40, R=3, home_advantage=0,
+                 set_map=None, postseason_multiplier=1):
+    """
+    Lazily replay matches, yielding the rating update of each one.
+
+    :source: Path of a match CSV, or an iterable of match rows. Matches must be
+             in date order, just like for `record_games`.
+    :teams: Optional teams with starting ratings. Teams first seen in the
+            source start at 1500. The given teams are updated after every
+            chunk.
+    :chunksize: Number of matches read and replayed at a time. Only one chunk
+                is held in memory.
+    :yields: `RatingUpdate`s with the pre-match Elos, the home win
+             probability and the match's Brier score (see `elo.brier`).
+
+    The remaining arguments are the same as for `record_games`.
+    """
+    teams = {team.name: team for team in teams}
+    names = list(teams)
+    index = {name: k for k, name in enumerate(names)}
+    elos = [team.elo for team in teams.values()]
+    last_seen = [None] * len(elos)
+
+    for chunk in _chunks(source, chunksize):
+        chunk["date"] = pd.to_datetime(chunk["date"])
+
+        for name in pd.concat([chunk.home, chunk.away]).unique():
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+                elos.append(1500)
+                last_seen.append(None)
+
+        home, away, days, home_won, sets = _match_arrays(chunk, index)
+        postseason = _postseason(chunk)
+        factors = _factors(sets, postseason, K, set_map, postseason_multiplier)
+
+        home_elo, away_elo, win_prob = _replay(home, away, days, home_won,
+                                               factors, elos, last_seen, R,
+                                               home_advantage)
+
+        for name, team in teams.items():
+            team.elo = elos[index[name]]
+
+        for k, date in enumerate(chunk.date):
+            yield RatingUpdate(date, names[home[k]], names[away[k]], home_elo[k],
+                               away_elo[k], win_prob[k],
+                               elo.brier(home_won[k], win_prob[k]))
 
 if __name__ == "__main__":
     teams, df = load_games("./data/games.csv")